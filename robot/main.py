@@ -93,11 +93,15 @@ class RoboClient:
             query.append(f"x-auth-token={auth_token}")
         if query:
             uri = f"{uri}?{'&'.join(query)}"
+        metrics_port = EnvBaseContext.get("TELEOP_METRICS_PORT", "")
+        stats_interval = EnvBaseContext.get("TELEOP_STATS_INTERVAL", "")
         self.client = ControlRTCRobot(
             robot=self.robot,
             ice_servers=ice_server,
             name="teleoperation",
-            uri=uri
+            uri=uri,
+            metrics_port=int(metrics_port or 0),
+            stats_interval=float(stats_interval or 5)
         )
         self._robot_status = RobotStatus(timer=.5)
         self.robot.connect()
@@ -209,6 +213,7 @@ class RoboClient:
         return {
             'type': 'robotStatus',
             'status': status,
+            'linkStats': self.client.link_stats,
             'timestamp': datetime.now().timestamp()
         }
 
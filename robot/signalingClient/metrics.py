@@ -0,0 +1,158 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import asyncio
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Union
+)
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    start_http_server
+)
+
+REGISTRY = CollectorRegistry(auto_describe=True)
+
+_LATENCY_BUCKETS = (
+    .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.
+)
+
+DATA_FUNC_DURATION = Histogram(
+    "teleop_robot_data_func_duration_seconds",
+    "Time spent in the data_func of a worker",
+    ["worker"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+FRAMES = Counter(
+    "teleop_robot_frames_total",
+    "Media frames produced by a worker, or lost as converting the data "
+    "of its data_func failed",
+    ["worker", "result"],
+    registry=REGISTRY,
+)
+ENCODE_DURATION = Histogram(
+    "teleop_robot_encode_duration_seconds",
+    "Time spent converting sensor data to media frames",
+    ["worker"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+DATACHANNEL_MESSAGES = Counter(
+    "teleop_robot_datachannel_messages_total",
+    "Messages sent on the data channel of a worker",
+    ["worker"],
+    registry=REGISTRY,
+)
+DATACHANNEL_BYTES = Counter(
+    "teleop_robot_datachannel_bytes_total",
+    "Bytes sent on the data channel of a worker",
+    ["worker"],
+    registry=REGISTRY,
+)
+DATACHANNEL_BUFFERED = Gauge(
+    "teleop_robot_datachannel_buffered_bytes",
+    "Bytes queued on the data channel of a worker",
+    ["worker"],
+    registry=REGISTRY,
+)
+PEER_CONNECTIONS = Gauge(
+    "teleop_robot_peer_connections",
+    "Open peer connections of a worker",
+    ["worker"],
+    registry=REGISTRY,
+)
+LOOP_LAG = Histogram(
+    "teleop_robot_event_loop_lag_seconds",
+    "Delay of the asyncio event loop in waking up a sleeping task",
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+
+
+class WorkerMetrics:
+    """
+    Metrics of a single ControlRTCRobot worker
+    """
+
+    def __init__(self, worker: str):
+        self.worker = worker
+        self.data_func_duration = DATA_FUNC_DURATION.labels(worker)
+        self.frames_produced = FRAMES.labels(worker, "produced")
+        # aiortc pulls frames from the track and reports no drops, so
+        # only the frames lost to a conversion error are counted
+        self.frame_errors = FRAMES.labels(worker, "error")
+        self.encode_duration = ENCODE_DURATION.labels(worker)
+        self.dc_messages = DATACHANNEL_MESSAGES.labels(worker)
+        self.dc_bytes = DATACHANNEL_BYTES.labels(worker)
+        self.dc_buffered = DATACHANNEL_BUFFERED.labels(worker)
+        self.peer_connections = PEER_CONNECTIONS.labels(worker)
+        self.frames = 0
+
+    def call_data_func(self, data_func: Callable) -> Any:
+        """
+        Call the data_func of the worker and observe its duration.
+        """
+        start = time.perf_counter()
+        try:
+            return data_func()
+        finally:
+            self.data_func_duration.observe(time.perf_counter() - start)
+
+    def frame_produced(self):
+        self.frames += 1
+        self.frames_produced.inc()
+
+    @contextmanager
+    def encoding(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.encode_duration.observe(time.perf_counter() - start)
+
+    def datachannel_sent(
+            self, message: Union[str, bytes], buffered_amount: int = 0
+    ):
+        self.dc_messages.inc()
+        if isinstance(message, str):
+            # sent as UTF-8, count bytes rather than characters
+            message = message.encode("utf-8")
+        self.dc_bytes.inc(len(message))
+        self.dc_buffered.set(buffered_amount)
+
+
+async def monitor_loop_lag(interval: float = .5):
+    """
+    Measure how late the event loop wakes up a task sleeping `interval`.
+    """
+    loop = asyncio.get_event_loop()
+    while 1:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(loop.time() - start - interval, 0))
+
+
+def serve(port: int, addr: str = "0.0.0.0"):
+    """
+    Serve the robot metrics on a local http endpoint.
+    """
+    start_http_server(port, addr=addr, registry=REGISTRY)
@@ -30,6 +30,8 @@ from aiortc.mediastreams import (
 from robosdk.utils.lazy_imports import LazyImport
 from robosdk.common.constant import InternalConst
 
+from signalingClient.metrics import WorkerMetrics
+
 
 class ICEServerModel(BaseModel):
     """
@@ -78,6 +80,7 @@ class SocketEvents(Enum):
     PEER_CALL = "call-peer"
     PEER_CALL_ICE_CANDIDATE = "send-ice-candidate"
     CLOSE_ALL = "close-all-room-peer-connections"
+    REPORT_STATS = "report-link-stats"
 
 
 class CameraStreamTrack(VideoStreamTrack):
@@ -91,12 +94,14 @@ class CameraStreamTrack(VideoStreamTrack):
             listen_track: Optional[MediaStreamTrack] = None,
             data_func: Optional[Callable] = None,
             message_callback: Optional[Callable] = None,
+            metrics: Optional[WorkerMetrics] = None,
     ):
         """
         :param name: The name of the track.
         :param listen_track: The track to listen to.
         :param data_func: The function to get data.
         :param message_callback: The callback function to handle message.
+        :param metrics: The metrics of the worker owning the track.
         """
         super().__init__()
         self.kind = "video"
@@ -104,12 +109,14 @@ class CameraStreamTrack(VideoStreamTrack):
         self.listen_track = listen_track
         self.data_func = data_func
         self.message_callback = message_callback
+        self.metrics = metrics or WorkerMetrics(name)
         self._av_lib = LazyImport("av")
 
     async def trans_frame(self, frame: np.ndarray, _format: str = "bgr24"):
         pts, time_base = await self.next_timestamp()
         # conver frame from ndarry to av frame
-        data = self._av_lib.VideoFrame.from_ndarray(frame, format=_format)
+        with self.metrics.encoding():
+            data = self._av_lib.VideoFrame.from_ndarray(frame, format=_format)
         data.time_base = time_base
         data.pts = pts
         return data
@@ -121,7 +128,13 @@ class CameraStreamTrack(VideoStreamTrack):
         if self.listen_track is not None:
             frame = await self.listen_track.recv()
         elif self.data_func is not None:
-            frame = await self.trans_frame(self.data_func())
+            data = self.metrics.call_data_func(self.data_func)
+            try:
+                frame = await self.trans_frame(data)
+            except Exception:
+                self.metrics.frame_errors.inc()
+                raise
+            self.metrics.frame_produced()
         else:
             frame = None
         if self.message_callback is not None:
@@ -142,12 +155,14 @@ class AudioStreamTrack(CameraStreamTrack):
             listen_track: Optional[MediaStreamTrack] = None,
             data_func: Optional[Callable] = None,
             message_callback: Optional[Callable] = None,
+            metrics: Optional[WorkerMetrics] = None,
     ):
         super().__init__(
             name,
             listen_track=listen_track,
             data_func=data_func,
-            message_callback=message_callback
+            message_callback=message_callback,
+            metrics=metrics
         )
         self.kind = "audio"
 
@@ -162,8 +177,9 @@ class AudioStreamTrack(CameraStreamTrack):
         timebase = fractions.Fraction(1, fr)
         pts = int(time.time() * fr)
         # conver frame from ndarry to av frame
-        data = self._av_lib.AudioFrame.from_ndarray(
-            array=frame, format=_format, layout=layout)  # noqa
+        with self.metrics.encoding():
+            data = self._av_lib.AudioFrame.from_ndarray(
+                array=frame, format=_format, layout=layout)  # noqa
         data.time_base = timebase
         data.pts = pts
         return data
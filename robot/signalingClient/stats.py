@@ -0,0 +1,133 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import asyncio
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+
+from robosdk.common.logger import logging
+
+
+class RTCStatsCollector:
+    """
+    Sample getStats of every live peer connection and aggregate the
+    link quality per worker.
+    """
+
+    def __init__(
+            self,
+            workers: Dict,
+            interval: float = 5.,
+            logger=None,
+    ):
+        """
+        :param workers: The SignalingClient of each worker, by namespace.
+        :param interval: Seconds between two samples.
+        :param logger: The logger.
+        """
+        self.workers = workers
+        self.interval = float(interval)
+        self.logger = logger or logging.bind(
+            instance="RTCStatsCollector", system=True
+        )
+        self.report: Dict = {}
+        self._callbacks: List[Callable[[Dict], Awaitable]] = []
+        # (worker, peer sid, ssrc) => (timestamp, bytesSent)
+        self._last_sent: Dict[Tuple[str, str, int], Tuple[float, int]] = {}
+
+    def on_report(self, callback: Callable[[Dict], Awaitable]):
+        """
+        Register a coroutine called with every new aggregate.
+        """
+        self._callbacks.append(callback)
+
+    async def run(self):
+        while 1:
+            await asyncio.sleep(self.interval)
+            try:
+                self.report = await self.collect()
+            except Exception as e:  # noqa
+                self.logger.error(f"collect rtc stats error: {e}")
+                continue
+            for callback in self._callbacks:
+                try:
+                    await callback(self.report)
+                except Exception as e:  # noqa
+                    self.logger.debug(f"publish rtc stats error: {e}")
+
+    async def collect(self) -> Dict:
+        now = time.time()
+        workers = {}
+        seen = set()
+        for name, worker in self.workers.items():
+            stats = {
+                "peers": 0,
+                "bitrate": 0.,
+                "rtt": None,
+                "packetsLost": 0,
+                "fractionLost": 0.,
+                "nackCount": 0,
+                "pliCount": 0,
+                "framesEncoded": worker.metrics.frames,
+            }
+            rtts = []
+            for peer in worker.peers:
+                if peer.pc.state != "connected":
+                    continue
+                try:
+                    report = await peer.pc.get_stats()
+                except Exception as e:  # noqa
+                    self.logger.debug(f"getStats of {peer.name} error: {e}")
+                    continue
+                stats["peers"] += 1
+                for item in report.values():
+                    kind = getattr(item, "type", "")
+                    if kind == "outbound-rtp":
+                        key = (name, peer.sid, item.ssrc)
+                        seen.add(key)
+                        stats["bitrate"] += self._bitrate(
+                            key, now, item.bytesSent
+                        )
+                        stats["nackCount"] += getattr(item, "nackCount", 0)
+                        stats["pliCount"] += getattr(item, "pliCount", 0)
+                    elif kind == "remote-inbound-rtp":
+                        stats["packetsLost"] += item.packetsLost or 0
+                        stats["fractionLost"] = max(
+                            stats["fractionLost"], item.fractionLost or 0.
+                        )
+                        if item.roundTripTime is not None:
+                            rtts.append(item.roundTripTime)
+            if rtts:
+                stats["rtt"] = sum(rtts) / len(rtts)
+            workers[name] = stats
+        # forget streams of closed peer connections
+        for key in set(self._last_sent) - seen:
+            del self._last_sent[key]
+        return {"timestamp": now, "workers": workers}
+
+    def _bitrate(
+            self, key: Tuple[str, str, int], now: float, bytes_sent: int
+    ) -> float:
+        last: Optional[Tuple[float, int]] = self._last_sent.get(key)
+        self._last_sent[key] = (now, bytes_sent)
+        if last is None or now <= last[0] or bytes_sent < last[1]:
+            return 0.
+        return (bytes_sent - last[1]) * 8 / (now - last[0])
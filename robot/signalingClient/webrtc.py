@@ -58,6 +58,12 @@ from signalingClient.models import (
     CameraStreamTrack,
     AudioStreamTrack
 )
+from signalingClient.metrics import (
+    WorkerMetrics,
+    monitor_loop_lag,
+    serve as serve_metrics
+)
+from signalingClient.stats import RTCStatsCollector
 
 
 class RoboRTCPeerConnection:
@@ -71,7 +77,8 @@ class RoboRTCPeerConnection:
             ice_servers: ICEServerModel,
             logger=None,
             data_func: Optional[Callable] = None,
-            message_callback: Optional[Callable] = None
+            message_callback: Optional[Callable] = None,
+            metrics: Optional[WorkerMetrics] = None
     ):
         """
         :param client: peer connection client
@@ -79,8 +86,10 @@ class RoboRTCPeerConnection:
         :param logger: logger
         :param data_func: The function to get data.
         :param message_callback: The callback function to handle message.
+        :param metrics: The metrics of the worker owning the connection.
         """
         self.client = client
+        self.metrics = metrics or WorkerMetrics(client.room or client.name)
         if logger is None:
             self.logger = logging.bind(
                 instance=f"{self.client.name}RTCPeerConnection",
@@ -154,14 +163,17 @@ class RoboRTCPeerConnection:
         self.on("track", self.on_track)
         self.on("datachannel", self._on_datachannel)
         self._initial = True
+        self.metrics.peer_connections.inc()
 
     async def close(self):
         """
         Close the connection.
         """
         self.logger.warning('[Event: Closing peer connection]')
+        if self._initial:
+            self._initial = False
+            self.metrics.peer_connections.dec()
         await self._pc.close()
-        self._initial = False
 
     def create_datachannel(
             self,
@@ -201,14 +213,16 @@ class RoboRTCPeerConnection:
                 name=name,
                 listen_track=listen_track,
                 data_func=self._data_func,
-                message_callback=self._message_callback
+                message_callback=self._message_callback,
+                metrics=self.metrics
             )
         elif kind == "audio":
             track = AudioStreamTrack(
                 name=name,
                 listen_track=listen_track,
                 data_func=self._data_func,
-                message_callback=self._message_callback
+                message_callback=self._message_callback,
+                metrics=self.metrics
             )
         if track:
             await self._on_track(track)
@@ -295,6 +309,12 @@ class RoboRTCPeerConnection:
 
         return channel
 
+    async def get_stats(self):
+        """
+        Get the RTCStatsReport of the connection.
+        """
+        return await self._pc.getStats()
+
     async def create_offer(self):
         await self._pc.setLocalDescription(await self._pc.createOffer())
         _offer = {
@@ -321,6 +341,7 @@ class SignalingClient:
     """
     webrtc signaling client
     """
+    MAX_REDIRECTS = 3
 
     def __init__(
             self,
@@ -341,10 +362,34 @@ class SignalingClient:
             self.logger = logger
         self.ice_servers = ice_servers
         self.client = client
+        self.metrics = WorkerMetrics(client.room or client.name)
         self._peer_client: Dict[str, RTCClient] = {}
         self._sio = None
+        self._redirect = ""
         self.kind = "signal"
 
+    @property
+    def peers(self) -> List[RTCClient]:
+        """
+        Peer clients with a peer connection.
+        """
+        return [
+            client for client in self._peer_client.values()
+            if client.pc is not None
+        ]
+
+    @property
+    def connected(self) -> bool:
+        return bool(getattr(self._sio, "connected", False))
+
+    async def emit(self, event: str, data=None):
+        """
+        Emit an event to the signaling server.
+        """
+        if not self.connected:
+            return
+        await self._sio.emit(event, data)
+
     def register_socket_envent(self):
         self._sio = socketio.AsyncClient(
             logger=False,
@@ -352,6 +397,7 @@ class SignalingClient:
             ssl_verify=False,
         )
         self._sio.event(self.connect)
+        self._sio.event(self.connect_error)
         self._sio.event(self.disconnect)
         self._sio.event(self.close)
         self._sio.on(
@@ -394,6 +440,38 @@ class SignalingClient:
             )
         self._sio = None
 
+    @staticmethod
+    def _with_affinity(socket_url: str) -> str:
+        """Ask the server for the worker the service of the robot lives on"""
+        parts = urllib.parse.urlsplit(socket_url)
+        query = urllib.parse.parse_qsl(parts.query)
+        if "affinity" not in dict(query):
+            query.append(("affinity", "1"))
+        return urllib.parse.urlunsplit(
+            parts._replace(query=urllib.parse.urlencode(query))
+        )
+
+    @staticmethod
+    def _redirect_url(socket_url: str, target: str) -> str:
+        """Point `socket_url` at the worker in `target`"""
+        target = urllib.parse.urlsplit(target)
+        return urllib.parse.urlunsplit(
+            urllib.parse.urlsplit(socket_url)._replace(
+                scheme=target.scheme, netloc=target.netloc
+            )
+        )
+
+    async def connect_error(self, data=None):
+        """
+        connect error, the server may refuse with the url of the worker
+        to connect to instead
+        """
+        if (
+                isinstance(data, dict) and data.get("message") == "redirect"
+                and isinstance(data.get("data"), dict)
+        ):
+            self._redirect = data["data"].get("url", "")
+
     async def async_run(
             self,
             socket_url: str = "http://127.0.0.1:5540/ws",
@@ -402,19 +480,31 @@ class SignalingClient:
         """
         Start the client.
         """
+        base_url = self._with_affinity(socket_url)
+        url, hops = base_url, 0
         while 1:
             if self._sio is not None:
                 await self._sio.disconnect()
             self.register_socket_envent()
+            self._redirect = ""
 
             try:
                 await self._sio.connect(
-                    socket_url,
+                    url,
                     socketio_path=socketio_path,
                     wait_timeout=ServiceConst.SocketTimeout.value
                 )
             except Exception as err:
+                redirect = self._redirect
+                if redirect and hops < self.MAX_REDIRECTS:
+                    hops += 1
+                    self.logger.info(f"redirected to {redirect}")
+                    url = self._redirect_url(base_url, redirect)
+                    continue
                 self.logger.error(f"connect error: {err}")
+                # start over, without affinity if redirects kept coming
+                url = socket_url if redirect else base_url
+                hops = 0
                 await asyncio.sleep(ServiceConst.APICallTryHold.value)
             else:
                 break
@@ -653,7 +743,8 @@ class DataChannelClient(SignalingClient):
             ice_servers=self.ice_servers,
             logger=self.logger,
             data_func=self._data_func,
-            message_callback=self._message_callback
+            message_callback=self._message_callback,
+            metrics=self.metrics
         )
         channel_name = client.room or "chat"
         self._data_channel = rtc_connection.create_datachannel(channel_name)
@@ -673,11 +764,15 @@ class DataChannelClient(SignalingClient):
             return
         while 1:
             if self._data_channel.readyState != "open":
+                await asyncio.sleep(1)
                 continue
-            status_dict: Dict = self._data_func()
+            status_dict: Dict = self.metrics.call_data_func(self._data_func)
             try:
                 my_data = json.dumps(status_dict)
                 self._data_channel.send(my_data)
+                self.metrics.datachannel_sent(
+                    my_data, self._data_channel.bufferedAmount
+                )
             except Exception as e:
                 self.logger.error(f"json dumps error: {e}")
                 continue
@@ -740,7 +835,8 @@ class StreamClient(SignalingClient):
             ice_servers=self.ice_servers,
             logger=self.logger,
             data_func=self._data_func,
-            message_callback=self._message_callback
+            message_callback=self._message_callback,
+            metrics=self.metrics
         )
         stream_name = client.room or "stream"
         if self.video_enable:
@@ -761,12 +857,17 @@ class ControlRTCRobot(ClientBase):  # noqa
                  name: str = "control",
                  loop=None,
                  ice_servers: Optional[ICEServerModel] = None,
+                 metrics_port: int = 0,
+                 stats_interval: float = 5.,
                  **kwargs,
                  ):
         """
         :param robot: The robot instance.
         :param name: The name of the client.
         :param loop: The event loop.
+        :param metrics_port: Port of the local metrics endpoint, 0 to disable.
+        :param stats_interval: Seconds between two WebRTC stats samples,
+            0 to disable.
         :param kwargs: The other parameters.
         """
         super(ControlRTCRobot, self).__init__(name=name, **kwargs)
@@ -777,6 +878,13 @@ class ControlRTCRobot(ClientBase):  # noqa
         self.robot = robot
         self._workers: Dict[str, SignalingClient] = {}
         self.ice_server = ice_servers
+        self.metrics_port = int(metrics_port or 0)
+        self.stats = RTCStatsCollector(
+            self._workers,
+            interval=float(stats_interval or 0),
+            logger=self.logger
+        )
+        self.stats.on_report(self._report_stats)
         if loop is None:
             try:
                 loop = asyncio.get_running_loop()
@@ -804,6 +912,19 @@ class ControlRTCRobot(ClientBase):  # noqa
             _path = '/' + _path
         return url, _path
 
+    @property
+    def link_stats(self) -> Dict:
+        """
+        Latest link quality aggregate of every worker.
+        """
+        return self.stats.report
+
+    async def _report_stats(self, report: Dict):
+        for w in self._workers.values():
+            if w.connected:
+                await w.emit(SocketEvents.REPORT_STATS.value, report)
+                return
+
     def add_worker(self,
                    name_space: str = "Teleop",
                    kind: str = "datachannel",
@@ -851,7 +972,16 @@ class ControlRTCRobot(ClientBase):  # noqa
 
     def run(self):
         setattr(self.robot, "control_mode", RoboControlMode.Remote)
-        workers = []
+        if self.metrics_port:
+            serve_metrics(self.metrics_port)
+            self.logger.info(f"metrics served on port {self.metrics_port}")
+        workers = [
+            asyncio.ensure_future(monitor_loop_lag(), loop=self.loop)
+        ]
+        if self.stats.interval > 0:
+            workers.append(
+                asyncio.ensure_future(self.stats.run(), loop=self.loop)
+            )
         for n, w in self._workers.items():
             main_task = asyncio.ensure_future(
                 w.async_run(
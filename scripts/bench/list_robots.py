@@ -0,0 +1,138 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time list_robots for a large fleet: reading every robot from Redis and
+encoding the response the way FastAPI does.
+
+    PYTHONPATH=. python scripts/bench/list_robots.py \
+        --redis redis://localhost:6379/15 --robots 5000
+
+The database given with --redis is flushed. With --codec-only, Redis is
+left out and only the decoding of the stored hashes is timed. The plain
+rows encoded with orjson are what list_robots returns now, --fields sets
+the projection timed besides all fields.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from server.orm.db import DataManage
+from server.orm.models import AppModel
+from server.orm.models import CameraModel
+from server.orm.models import RoboSkillModel
+from server.orm.models import RobotModel
+
+
+def _fleet(num: int):
+    return [
+        RobotModel(
+            robot_id=f"bench-{i:05d}",
+            service_id=f"service-{i:05d}",
+            robot_name=f"robot {i}",
+            robot_type="quadruped_robot",
+            status="RUNNING",
+            camera=[
+                CameraModel(camera_name=name, camera_type="rgb",
+                            camera_url=f"rtsp://10.0.0.{i % 255}/{name}")
+                for name in ("front", "back")
+            ],
+            skills=[
+                RoboSkillModel(skill_id=f"skill-{j}", skill_name=f"skill {j}",
+                               parameters={"speed": j})
+                for j in range(3)
+            ],
+            application={
+                name: AppModel(app_id=f"{name}-{i}", app_name=name,
+                               app_version="1.0", status="running",
+                               run_env={"TELEOP_ROBOT_ID": f"bench-{i:05d}"})
+                for name in ("teleop", "navigation")
+            },
+        )
+        for i in range(num)
+    ]
+
+
+def _report(name: str, cost: float, num: int, size: int = 0):
+    size = f", {size / 1024:9.1f} KiB" if size else ""
+    print(f"{name:>22}: {cost * 1000:9.1f} ms for {num} robots{size}")
+
+
+def codec_only(num: int, rounds: int, fields):
+    codec = DataManage.ROBOT_CODEC
+    mappings = [codec.encode(robot) for robot in _fleet(num)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        robots = [codec.decode(mapping) for mapping in mappings]
+    _report("decode", (time.perf_counter() - start) / rounds, num)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        body = json.dumps(jsonable_encoder({"total": num, "robots": robots}))
+    _report("encode response", (time.perf_counter() - start) / rounds, num,
+            len(body))
+    for name, names in (("rows", list(codec.model.__fields__)),
+                        ("projected rows", fields)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            rows = [codec.decode_values(mapping, names)
+                    for mapping in mappings]
+            body = orjson.dumps({"total": num, "robots": rows})
+        _report(f"{name} + orjson", (time.perf_counter() - start) / rounds,
+                num, len(body))
+
+
+async def main(url: str, num: int, rounds: int, fields):
+    db = DataManage()
+    await db.create_redis(url)
+    await db.redis.flushdb()
+    await db.update_robots(_fleet(num))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        robots = await db.get_all_robots()
+    _report("get_all_robots", (time.perf_counter() - start) / rounds, num)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        body = json.dumps(jsonable_encoder({"total": num, "robots": robots}))
+    _report("encode response", (time.perf_counter() - start) / rounds, num,
+            len(body))
+    for name, names in (("get_robot_rows", None), ("projected rows", fields)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            rows = await db.get_robot_rows(names)
+            body = orjson.dumps({"total": num, "robots": rows})
+        _report(f"{name} + orjson", (time.perf_counter() - start) / rounds,
+                num, len(body))
+    await db.redis.flushdb()
+    await db.close_redis()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis", default="redis://localhost:6379/15")
+    parser.add_argument("--robots", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--codec-only", action="store_true")
+    parser.add_argument("--fields",
+                        default="robot_id,robot_name,status,service_id")
+    args = parser.parse_args()
+    fields = args.fields.split(",")
+    if args.codec_only:
+        codec_only(args.robots, args.rounds, fields)
+    else:
+        asyncio.run(main(args.redis, args.robots, args.rounds, fields))
@@ -0,0 +1,85 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time a full OMS robot refresh, and how soon the first robot streams
+in, against a local stand-in for OMS that answers every page after
+--rtt milliseconds, one page at a time and with concurrent pages.
+
+    PYTHONPATH=. python scripts/bench/oms_pages.py --robots 5000 --rtt 50
+"""
+
+import time
+import asyncio
+import argparse
+
+from aiohttp import web
+
+from server.utils.cloud_apis import CloudOMSProxy
+
+
+def _app(num: int, rtt: float) -> web.Application:
+    robots = [
+        {"id": f"bench-{i:05d}", "name": f"robot {i}", "type": "x20"}
+        for i in range(num)
+    ]
+
+    async def roboinstances(request: web.Request):
+        await asyncio.sleep(rtt)
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query.get("limit", 100))
+        return web.json_response({
+            "roboinstances": robots[offset:offset + limit],
+            "count": num
+        })
+
+    app = web.Application()
+    app.router.add_get("/roboinstances", roboinstances)
+    return app
+
+
+async def main(num: int, rtt: float, concurrency: int, port: int):
+    runner = web.AppRunner(_app(num, rtt / 1000))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    for name, limit in (("one by one", 1), ("concurrent", concurrency)):
+        oms = CloudOMSProxy(config={
+            "oms_server_uri": f"http://127.0.0.1:{port}",
+            "cloud_page_concurrency": limit,
+        })
+        start = time.perf_counter()
+        first = None
+        robots = []
+        async for robot in oms.iter_robots():
+            if first is None:
+                first = time.perf_counter() - start
+            robots.append(robot)
+        cost = time.perf_counter() - start
+        assert [r["id"] for r in robots] == [
+            f"bench-{i:05d}" for i in range(num)
+        ]
+        print(f"{name:>10}: {cost * 1000:9.1f} ms for {len(robots)} robots,"
+              f" first after {first * 1000:.1f} ms")
+        await oms.close()
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--robots", type=int, default=5000)
+    parser.add_argument("--rtt", type=float, default=50, help="ms")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+    asyncio.run(main(args.robots, args.rtt, args.concurrency, args.port))
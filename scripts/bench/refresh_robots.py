@@ -0,0 +1,90 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare a per-robot and a bulk refresh of the robot fleet in Redis,
+with every robot changed since the last refresh and with none changed.
+
+    PYTHONPATH=. python scripts/bench/refresh_robots.py \
+        --redis redis://localhost:6379/15 --robots 2000
+
+The database given with --redis is flushed.
+"""
+
+import time
+import asyncio
+import argparse
+
+from server.orm.db import DataManage
+from server.orm.models import RobotModel
+
+
+def _fleet(num: int):
+    return [
+        RobotModel(
+            robot_id=f"bench-{i:05d}",
+            robot_name=f"robot {i}",
+            robot_type="quadruped_robot",
+            status="RUNNING",
+            application={},
+        )
+        for i in range(num)
+    ]
+
+
+async def per_robot(db: DataManage, robots):
+    for robot in robots:
+        await db.get_robot(robot.robot_id)
+        await db.update_robot(robot.robot_id, robot)
+
+
+async def bulk(db: DataManage, robots):
+    await db.get_robots(robot.robot_id for robot in robots)
+    await db.update_robots(robots)
+
+
+async def main(url: str, num: int, rounds: int):
+    db = DataManage()
+    await db.create_redis(url)
+    await db.redis.flushdb()
+    robots = _fleet(num)
+    await db.update_robots(robots)
+    for name, func, changed in (
+            ("per-robot", per_robot, True),
+            ("bulk", bulk, True),
+            ("unchanged", bulk, False),
+    ):
+        cost = 0.
+        for inx in range(rounds):
+            if changed:
+                for robot in robots:
+                    robot.status = f"RUNNING {name} {inx}"
+            # every refresh misses the cache as oms rewrites every robot
+            db._robots.clear()
+            start = time.perf_counter()
+            await func(db, robots)
+            cost += time.perf_counter() - start
+        cost /= rounds
+        print(f"{name:>10}: {cost * 1000:9.1f} ms per refresh of {num}")
+    await db.redis.flushdb()
+    await db.close_redis()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis", default="redis://localhost:6379/15")
+    parser.add_argument("--robots", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.redis, args.robots, args.rounds))
@@ -0,0 +1,89 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare REST requests per second with the errors handled by an
+`app.middleware('http')` wrapper and by RequestMiddleware alone.
+
+    PYTHONPATH=. python scripts/bench/rest_middleware.py --requests 5000
+
+Requests go to the ASGI app through httpx, without a server or Redis.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+
+import httpx
+from fastapi import FastAPI
+from fastapi import Request
+from fastapi import Response
+from robosdk.common.exceptions import CloudError
+
+from server.apis.middleware import RequestMiddleware
+
+TOKEN = "bench-token"
+
+
+async def _ok():
+    return {"total": 1, "services": [{"service_id": "bench"}]}
+
+
+async def _fail():
+    raise CloudError(status_code=404, message="service bench not found")
+
+
+async def _wrapped(request: Request, call_next):
+    # the error handling RequestMiddleware took over
+    try:
+        return await call_next(request)
+    except CloudError as e:
+        return Response(
+            status_code=e.status_code,
+            content=json.dumps({"code": e.status_code, "message": e.message})
+        )
+
+
+def _app(wrapped: bool) -> FastAPI:
+    app = FastAPI()
+    app.add_api_route("/v1/ok", _ok, methods=["GET"])
+    app.add_api_route("/v1/fail", _fail, methods=["GET"])
+    app.add_middleware(RequestMiddleware, auth_token=TOKEN)
+    if wrapped:
+        app.middleware("http")(_wrapped)
+    return app
+
+
+async def main(num: int):
+    for path in ("/v1/ok", "/v1/fail"):
+        for name, wrapped in (("http wrapper", True), ("pure asgi", False)):
+            transport = httpx.ASGITransport(app=_app(wrapped))
+            async with httpx.AsyncClient(
+                    transport=transport, base_url="http://bench",
+                    headers={"X-Auth-Token": TOKEN}
+            ) as client:
+                code = (await client.get(path)).status_code
+                start = time.perf_counter()
+                for _ in range(num):
+                    await client.get(path)
+                cost = time.perf_counter() - start
+            print(f"{path:>9} {name:>13}: {num / cost:9.0f} req/s ({code})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
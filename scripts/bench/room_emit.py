@@ -0,0 +1,89 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the cost of telling every participant of an RTC room about a
+change with one emit per sid and with one emit to a socket.io room.
+
+    PYTHONPATH=. python scripts/bench/room_emit.py --participants 6 50 500
+
+Packets are encoded but not written to any socket.
+"""
+
+import time
+import asyncio
+import inspect
+import argparse
+
+import socketio
+
+
+class _Server(socketio.AsyncServer):
+    async def _send_packet(self, eio_sid, pkt):
+        pkt.encode()
+
+    async def _send_eio_packet(self, eio_sid, eio_pkt):
+        pass
+
+
+async def _maybe_await(ret):
+    if inspect.isawaitable(ret):
+        await ret
+
+
+async def _room(sio: socketio.AsyncServer, num: int):
+    sio.manager.initialize()
+    sids = []
+    for i in range(num):
+        sid = sio.manager.connect(f"eio-{num}-{i}", "/")
+        if inspect.isawaitable(sid):
+            sid = await sid
+        await _maybe_await(sio.enter_room(sid, f"room-{num}"))
+        sids.append(sid)
+    return sids
+
+
+async def main(sizes, rounds: int):
+    sio = _Server(async_mode="asgi")
+    data = [{"id": f"sid-{i}", "name": f"client-{i}", "type": "subscriber"}
+            for i in range(6)]
+    for num in sizes:
+        sids = await _room(sio, num)
+
+        async def per_sid():
+            await asyncio.wait([
+                asyncio.ensure_future(sio.emit("room-clients", data, to=sid))
+                for sid in sids
+            ])
+
+        async def room():
+            await sio.emit("room-clients", data, room=f"room-{num}",
+                           skip_sid=sids[0])
+
+        for name, func in (("per-sid", per_sid), ("room", room)):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                await func()
+            cost = (time.perf_counter() - start) / rounds
+            print(f"{num:>5} participants {name:>8}: "
+                  f"{cost * 1e6:9.1f} us per update")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--participants", type=int, nargs="+",
+                        default=[6, 50, 500])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.participants, args.rounds))
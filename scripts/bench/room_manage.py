@@ -0,0 +1,80 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time the RoomManage operations of the gateway for one large service.
+
+    PYTHONPATH=. python scripts/bench/room_manage.py \
+        --rooms 2000 --clients 5000
+"""
+
+import time
+import random
+import argparse
+
+from server.orm.models import RoomClient
+from server.orm.models import RoomManage
+
+
+def _timed(name: str, func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    cost = time.perf_counter() - start
+    print(f"{name:>14}: {cost * 1e6 / len(items):9.2f} us/op")
+
+
+def main(num_rooms: int, num_clients: int, rooms_per_client: int):
+    rtc = RoomManage("bench")
+    rtc.initial()
+    for i in range(num_rooms):
+        rtc.create_room(
+            room_name=f"room-{i}", room_type="video", max_users=num_clients
+        )
+    room_names = [f"room-{i}" for i in range(num_rooms)]
+    room_ids = [room.room_id for room in rtc.rooms.values()]
+    rand = random.Random(0)
+    joins = [
+        (RoomClient(
+            client_id=f"sid-{i}", client_name=f"client-{i}",
+            client_type="subscriber"
+        ), room_name)
+        for i in range(num_clients)
+        for room_name in rand.sample(room_names, rooms_per_client)
+    ]
+
+    def join(item):
+        client, room_name = item
+        rtc.join_room(rtc.get_room(room_name=room_name), client)
+
+    def leave(item):
+        client, room_name = item
+        rtc.leave_room(rtc.get_room(room_name=room_name), client.client_id)
+
+    _timed("join", join, joins)
+    _timed("get_room_by_id", rtc.get_room_by_id, room_ids)
+    _timed("get_room_alias", rtc.get_room_by_alias, ["missing"] * len(room_ids))
+    _timed("leave", leave, joins[::2])
+    _timed("kick", rtc.kcick, [f"sid-{i}" for i in range(num_clients)])
+    _timed("delete_room", lambda name: rtc.delete_room(room_name=name),
+           room_names[::-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--rooms-per-client", type=int, default=3)
+    args = parser.parse_args()
+    main(args.rooms, args.clients, args.rooms_per_client)
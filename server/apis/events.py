@@ -0,0 +1,233 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+
+import orjson
+from fastapi.routing import APIRoute
+from starlette.responses import StreamingResponse
+
+from server.orm.db import DataManage
+from server.orm.models import RobotModel
+from server.utils.utils import parse_fields
+from server.apis.__version__ import __version__ as version
+
+
+class _Subscriber:
+    """A console connected to the change feed."""
+
+    def __init__(self, fields: Optional[List[str]], maxsize: int):
+        self.fields = fields
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def push(self, event: str, data: bytes):
+        try:
+            self.queue.put_nowait(
+                b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+            )
+        except asyncio.QueueFull:
+            # too far behind, end the stream: the console reconnects and
+            # reloads the list
+            self.close()
+
+    def close(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class ChangeFeedAPI:
+    """
+    Push the robots and services changed on any gateway worker to the
+    consoles as server-sent events, instead of them polling the lists.
+    """
+    prefix = f"/{version}/events"
+    FLUSH_S = 0.2
+    KEEPALIVE_S = 15
+    QUEUE_SIZE = 1000
+    SERVICE_FIELDS = ["service_id", "user_id", "status", "update_time"]
+
+    def __init__(self, redis_client: DataManage, logger):
+        self.redis_client = redis_client
+        self.logger = logger
+        self._subscribers: Set[_Subscriber] = set()
+        # keys written since the last flush
+        self._dirty: Set[str] = set()
+        self._changed: Optional[asyncio.Event] = None
+        # service_id => status, to push status transitions only
+        self._service_status: Dict[str, Any] = {}
+        # robot_id => the robot as last pushed, shared by the subscribers;
+        # every subscriber has it, pushed or in the list loaded on ready
+        self._robots: Dict[str, Dict[str, Any]] = {}
+        self._should_exit = False
+        redis_client.add_invalidation_listener(self._on_invalidate)
+
+    def initial(self) -> List[APIRoute]:
+        return [
+            APIRoute(
+                path=self.prefix,
+                endpoint=self.stream_events,
+                methods=["GET"],
+                name="stream_events",
+                tags=["event"],
+                summary="Stream robot and service changes",
+            ),
+        ]
+
+    async def stream_events(self, fields: Optional[str] = None):
+        """
+        Stream robot and service changes as server-sent events
+        :param fields: comma separated robot fields to push, e.g.
+            robot_id,robot_name,status,service_id; all by default.
+        """
+        subscriber = _Subscriber(
+            parse_fields(fields, RobotModel), self.QUEUE_SIZE
+        )
+        return StreamingResponse(
+            self._events(subscriber),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    async def _events(self, subscriber: _Subscriber) -> AsyncIterator[bytes]:
+        self._subscribers.add(subscriber)
+        try:
+            # changes from now on are pushed, load the lists after this
+            yield b"event: ready\ndata: {}\n\n"
+            while 1:
+                try:
+                    message = await asyncio.wait_for(
+                        subscriber.queue.get(), self.KEEPALIVE_S
+                    )
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def _on_invalidate(self, key: str):
+        if not key.startswith((
+                DataManage.REDIS_PREFIX_ROBOT,
+                DataManage.REDIS_PREFIX_SERVICE
+        )):
+            return
+        self._dirty.add(key)
+        if self._changed is not None:
+            self._changed.set()
+
+    async def run(self):
+        """Push the changes of robots and services until close."""
+        self._changed = asyncio.Event()
+        while self.redis_client.redis is None:
+            await asyncio.sleep(1)
+        for row in await self.redis_client.get_service_rows(
+                ["service_id", "status"]
+        ):
+            self._service_status[row["service_id"]] = row["status"]
+        while not self._should_exit:
+            await self._changed.wait()
+            # a robot refresh writes in bursts, read them all at once
+            await asyncio.sleep(self.FLUSH_S)
+            self._changed.clear()
+            keys, self._dirty = self._dirty, set()
+            try:
+                await self._flush(keys)
+            except Exception as err:  # noqa
+                self.logger.error(f"Push changes error: {err}")
+
+    def close(self):
+        self._should_exit = True
+        for subscriber in list(self._subscribers):
+            subscriber.close()
+
+    async def _flush(self, keys: Set[str]):
+        robot_ids = sorted(
+            key[len(DataManage.REDIS_PREFIX_ROBOT):] for key in keys
+            if key.startswith(DataManage.REDIS_PREFIX_ROBOT)
+        )
+        service_ids = sorted(
+            key[len(DataManage.REDIS_PREFIX_SERVICE):] for key in keys
+            if key.startswith(DataManage.REDIS_PREFIX_SERVICE)
+        )
+        if robot_ids and self._subscribers:
+            await self._push_robots(robot_ids)
+        else:
+            # not read, so what was pushed last may be stale
+            for robot_id in robot_ids:
+                self._robots.pop(robot_id, None)
+        if service_ids:
+            await self._push_services(service_ids)
+
+    async def _push_robots(self, robot_ids: List[str]):
+        rows = {
+            row["robot_id"]: row
+            for row in await self.redis_client.read_robot_rows(robot_ids)
+        }
+        for robot_id in robot_ids:
+            row = rows.get(robot_id)
+            last = self._robots.pop(robot_id, None)
+            if row is None:
+                self._publish("robot_deleted", {"robot_id": robot_id})
+                continue
+            self._robots[robot_id] = row
+            full = None
+            for subscriber in list(self._subscribers):
+                fields = subscriber.fields
+                # a write may leave the pushed fields as they were
+                if last is not None and all(
+                        last.get(name) == row.get(name)
+                        for name in (fields or row)
+                ):
+                    continue
+                if fields:
+                    data = orjson.dumps(
+                        {name: row.get(name) for name in fields}
+                    )
+                else:
+                    full = full or orjson.dumps(row)
+                    data = full
+                subscriber.push("robot", data)
+
+    async def _push_services(self, service_ids: List[str]):
+        rows = {
+            row["service_id"]: row
+            for row in await self.redis_client.read_service_rows(
+                service_ids, self.SERVICE_FIELDS
+            )
+        }
+        for service_id in service_ids:
+            row = rows.get(service_id)
+            if row is None:
+                if self._service_status.pop(service_id, None) is None:
+                    continue
+                self._publish("service_deleted", {"service_id": service_id})
+                continue
+            if self._service_status.get(service_id) == row["status"]:
+                continue
+            self._service_status[service_id] = row["status"]
+            self._publish("service", row)
+
+    def _publish(self, event: str, data: Dict[str, Any]):
+        message = orjson.dumps(data)
+        for subscriber in list(self._subscribers):
+            subscriber.push(event, message)
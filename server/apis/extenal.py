@@ -17,6 +17,7 @@ import asyncio
 import traceback
 import yaml
 from enum import Enum
+from typing import AsyncIterator
 from typing import List
 from typing import Dict
 from typing import Optional
@@ -73,7 +74,6 @@ class RTCModel(BaseModel):
 
 
 class CloudRTCProxy(CloudAPIProxy):
-    _page_size = 100
     __update_period__ = 60
 
     def __init__(
@@ -202,33 +202,18 @@ class CloudRTCProxy(CloudAPIProxy):
         res = await resp.json()
         return res
 
-    async def get_all(self, offset: int = 0) -> List[Dict]:
-        """ get all rtc app """
+    async def iter_all(self) -> AsyncIterator[Dict]:
+        """ stream all rtc app """
         url = f"{self.server_uri}/apps"
-        params = {
-            "offset": offset,
-            "limit": self._page_size
-        }
-        resp = await self.__session__.get(
-            url,
-            params=params,
-            headers=self._ext_header
-        )
-        if resp.status != 200:
-            _text = await resp.text()
-            self.logger.debug(f"Call {url} fail: {params} => {_text}")
-            raise CloudError("get rtc app failed", resp.status)
-        res = await resp.json()
-        count = res.get("count", 0)
-        apps = res.get("apps", [])
+        async for page in self._list_pages(
+                url, "apps", error="get rtc app failed"
+        ):
+            for app in page:
+                yield app
 
-        if count > offset + self._page_size:
-            apps.extend(
-                await self.get_all(
-                    offset=offset + self._page_size
-                )
-            )
-        return apps
+    async def get_all(self) -> List[Dict]:
+        """ get all rtc app """
+        return [app async for app in self.iter_all()]
 
     def get_signature(
             self, app_key: str, app_id: str,
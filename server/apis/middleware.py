@@ -12,31 +12,68 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hmac
 import json
-import traceback
+import asyncio
+from typing import Any
+from typing import Dict
+from typing import Iterable
 from typing import Optional
+from typing import Tuple
 
+from cachetools import TTLCache
+from starlette.exceptions import HTTPException
 from starlette.types import ASGIApp
-from fastapi import Request
-from fastapi import Response
-from fastapi.exceptions import HTTPException
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
 from robosdk.common.exceptions import CloudError
+from robosdk.common.logger import logging
 
-from server.orm.models import ServiceModel
+from server.orm.db import DataManage
+
+
+def _get_header(headers: Iterable[Tuple[bytes, bytes]], name: bytes) -> bytes:
+    """Get a header of an ASGI scope by its lower-case name."""
+    for key, value in headers:
+        if key == name:
+            return value
+    return b""
 
 
 class RequestMiddleware:
+    """
+    Authenticate requests and websocket connections, and turn the
+    exceptions of HTTP requests into JSON error responses.
+    """
+    TOKEN_CACHE_TTL = 10
+    TOKEN_CACHE_SIZE = 1000
+
     def __init__(
             self,
             app: ASGIApp,
             auth_token: str = None,
-            redis_client=None
+            redis_client: Optional[DataManage] = None,
+            logger=None
     ):
         self.app = app
+        self.logger = logger or logging.bind(
+            instance="RequestMiddleware", system=True
+        )
         self._auth_token = auth_token
+        self._auth_digest = (auth_token or "").upper().strip().encode()
         self.redis_client = redis_client
+        # service_id => token, None for unknown services
+        self._tokens: TTLCache = TTLCache(
+            maxsize=self.TOKEN_CACHE_SIZE, ttl=self.TOKEN_CACHE_TTL
+        )
+        # one Redis read per service however many clients connect at once
+        self._token_loads: Dict[str, asyncio.Task] = {}
+        if redis_client is not None:
+            redis_client.add_invalidation_listener(self._on_invalidate)
 
-    async def __call__(self, scope, receive, send):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         if scope["type"] not in ("lifespan", "http", "websocket"):
             raise CloudError(
                 status_code=500,
@@ -48,20 +85,10 @@ class RequestMiddleware:
                 )
             )
 
-        if scope["type"] == "http" and self._auth_token:
-            # get iam token from request header
-            headers = dict(scope["headers"])
-            token = headers.get(b"x-auth-token", b"").decode()
-            if not token:
-                query_string = scope["query_string"].decode()
-                token = self._get_token("x-auth-token", query_string, "")
-            if not self.verify_restful_token(token):
-                raise CloudError(
-                    status_code=401,
-                    message=json.dumps(
-                        {"code": 401, "message": "X-Auth-Token is invalid"})
-                )
-        elif scope["type"] == "websocket":
+        if scope["type"] == "http":
+            await self._call_http(scope, receive, send)
+            return
+        if scope["type"] == "websocket":
             # get service id from path
             path = scope["path"].strip("/").split("/")
             service_id = path[2] if len(path) > 2 else ""
@@ -78,22 +105,104 @@ class RequestMiddleware:
 
         await self.app(scope, receive, send)
 
+    async def _call_http(self, scope: Scope, receive: Receive, send: Send):
+        started = False
+
+        async def _send(message: Message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            if self._auth_token:
+                # get iam token from request header
+                token = _get_header(
+                    scope["headers"], b"x-auth-token"
+                ).decode()
+                if not token:
+                    query_string = scope["query_string"].decode()
+                    token = self._get_token("x-auth-token", query_string, "")
+                if not self.verify_restful_token(token):
+                    raise CloudError(
+                        status_code=401,
+                        message=json.dumps(
+                            {"code": 401,
+                             "message": "X-Auth-Token is invalid"})
+                    )
+            await self.app(scope, receive, _send)
+        except Exception as err:  # noqa
+            if started:
+                # too late for an error response, let the server drop it
+                raise
+            status_code, content = self._error_content(err)
+            body = json.dumps(content).encode()
+            await send({
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+
+    def _error_content(self, err: Exception) -> Tuple[int, Dict[str, Any]]:
+        if isinstance(err, HTTPException):
+            self.logger.debug(f"HTTPException: {err.detail}")
+            return err.status_code, {
+                "detail": err.detail, "code": err.status_code
+            }
+        if isinstance(err, CloudError):
+            self.logger.warning(f"CloudError {err.status_code}: {err.message}")
+            return err.status_code, {
+                "code": err.status_code, "message": err.message
+            }
+        self.logger.exception(f"Exception: {err}")
+        return 500, {"detail": "Internal server error", "code": 500}
+
     @staticmethod
     def _get_token(key: str, query_string: str, default="") -> str:
         key = key.strip().lower()
         if not (query_string and key):
             return default
-        query_param = query_string.split("&")
-        token = default
-        for param in query_param:
-            items = param.split("=")
-            if not len(items) == 2:
-                continue
-            if items[0].strip().lower() == key:
-                token = items[1].strip()
-                break
+        for param in query_string.split("&"):
+            name, sep, value = param.partition("=")
+            if sep and name.strip().lower() == key:
+                return value.strip()
+        return default
+
+    def _on_invalidate(self, key: str):
+        # a service written or deleted on any replica
+        prefix = DataManage.REDIS_PREFIX_SERVICE
+        if key.startswith(prefix):
+            self._tokens.pop(key[len(prefix):], None)
+            self._token_loads.pop(key[len(prefix):], None)
+
+    async def _load_token(self, service_id: str) -> Optional[str]:
+        try:
+            token = await self.redis_client.get_service_token(service_id)
+        finally:
+            # not cached when the service changed during the read
+            current = self._token_loads.get(service_id)
+            if current is asyncio.current_task():
+                del self._token_loads[service_id]
+        if current is asyncio.current_task():
+            self._tokens[service_id] = token
         return token
 
+    async def get_service_token(self, service_id: str) -> Optional[str]:
+        try:
+            return self._tokens[service_id]
+        except KeyError:
+            pass
+        task = self._token_loads.get(service_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_token(service_id))
+            self._token_loads[service_id] = task
+        # a cancelled connection must not cancel the shared read
+        return await asyncio.shield(task)
+
     async def verify_websocket_token(
             self, service_id: str,
             token: Optional[str] = ""
@@ -103,40 +212,19 @@ class RequestMiddleware:
         # get info from redis
         if self.redis_client is None:
             return False
-        info: ServiceModel = await self.redis_client.get_service(service_id)
-        if info is None:
+        expected = await self.get_service_token(service_id)
+        if expected is None:
             return False
-
-        return info.token.strip() == token.strip()
+        return hmac.compare_digest(
+            expected.strip().encode(), token.strip().encode()
+        )
 
     def verify_restful_token(
             self, token: Optional[str] = ""
     ):
         if not token:
             return True
-        return token.upper().strip() == self._auth_token.upper().strip()
-
-
-async def catch_exceptions_middleware(request: Request, call_next):
-
-    try:
-        response = await call_next(request)
-    except HTTPException as exc:
-        print(f"HTTPException: {exc}", traceback.format_exc())
-        response = Response(
-            content=json.dumps({"detail": exc.detail, "code": exc.status_code}),
-            status_code=exc.status_code)
-    except CloudError as e:
-        traceback.print_exc()
-        return Response(
-            status_code=e.status_code,
-            content=json.dumps({"code": e.status_code, "message": e.message})
+        return hmac.compare_digest(
+            token.upper().strip().encode(), self._auth_digest
         )
-    except Exception as err:  # noqa
-        print(f"Exception: {err}", traceback.format_exc())
-        response = Response(
-            content=json.dumps(
-                {"detail": "Internal server error", "code": 500}
-            ),
-            status_code=500)
-    return response
+
@@ -29,6 +29,7 @@ from robosdk.common.config import BaseConfig
 from robosdk.common.exceptions import CloudError
 from robosdk.utils.util import parse_kwargs
 from starlette.responses import FileResponse
+from starlette.responses import Response
 from robosdk.cloud_robotics.cloud_base import ServiceBase
 
 from server.orm.db import DataManage
@@ -38,11 +39,12 @@ from server.orm.models import ICEServerModel
 from server.utils.cloud_apis import CloudAuthProxy
 from server.utils.cloud_apis import CloudOMSProxy
 from server.utils.utils import EventManager
+from server.utils import metrics
 from server.apis.service import ServerAPI
 from server.apis.robot import RobotAPI
+from server.apis.events import ChangeFeedAPI
 from server.apis.ws import WebRTCGatewayWSServer
 from server.apis.middleware import RequestMiddleware
-from server.apis.middleware import catch_exceptions_middleware
 from server.apis.__version__ import __version__ as version
 
 
@@ -123,10 +125,21 @@ class SignalGatewayAPI(ServiceBase):  # noqa
             deploy_app_env=deploy_app_env,
             oms=self._oms_api,
         )
+        self.change_feed = ChangeFeedAPI(self.redis_client, self.logger)
 
+        # share socket.io messages between gateway workers through Redis
+        socketio_redis_url = self._config.get(
+            "socketio_redis_url", ""
+        ).strip()
         self._ws_server = WebRTCGatewayWSServer(
             logger=self.logger,
             redis_client=self.redis_client,
+            client_manager=socketio.AsyncRedisManager(
+                socketio_redis_url, channel="teleop-socketio"
+            ) if socketio_redis_url else None,
+            advertise_url=self._config.get(
+                "teleop_replica_url", ""
+            ).strip(),
         )
         self.server = None
 
@@ -187,6 +200,11 @@ class SignalGatewayAPI(ServiceBase):  # noqa
             )
         )
 
+    async def get_metrics(self) -> Response:
+        self._ws_server.collect_metrics()
+        content, media_type = metrics.render()
+        return Response(content=content, media_type=media_type)
+
     def initial(self, **kwargs):
         if self.server is not None:
             return
@@ -198,10 +216,16 @@ class SignalGatewayAPI(ServiceBase):  # noqa
             APIRoute(
                 f"/{version}/{self.name}/download",
                 self.get_download_urls
+            ),
+            APIRoute(
+                "/metrics",
+                self.get_metrics,
+                include_in_schema=False
             )
         ]
         rounters.extend(self.server_manage.initial())
         rounters.extend(self.robot_manage.initial())
+        rounters.extend(self.change_feed.initial())
         self._event_bus.emit("initial", server=self)
         self.app = FastAPI(
             title=self.name,
@@ -216,9 +240,9 @@ class SignalGatewayAPI(ServiceBase):  # noqa
         self.app.add_middleware(
             RequestMiddleware,
             auth_token=self._config.get(self.api_secret_name, "").strip(),
-            redis_client=self.redis_client
+            redis_client=self.redis_client,
+            logger=self.logger
         )
-        self.app.middleware('http')(catch_exceptions_middleware)
         if not hasattr(self.app, "mount"):
             self.logger.error("The version of fastapi is too low")
             return
@@ -231,6 +255,12 @@ class SignalGatewayAPI(ServiceBase):  # noqa
         )
 
         all_k: Dict = parse_kwargs(uvicorn.Config, **kwargs)
+        if all_k.pop("workers", None) not in (None, 1):
+            # serve() runs one worker, and every gateway process must
+            # have its own teleop_replica_url for routing to work
+            self.logger.warning(
+                "workers is ignored, run one gateway process per url"
+            )
         all_k.update(dict(
             app=self.app,
             host=self.host,
@@ -249,9 +279,10 @@ class SignalGatewayAPI(ServiceBase):  # noqa
 
     async def _on_shutdown(self):
         self.logger.debug("Server shutdown")
+        self.change_feed.close()
         if self.app.state.redis is not None:
             try:
-                await self.app.state.redis.close()
+                await self.app.state.redis.close_redis()
             except:  # noqa
                 pass
         self._event_bus.emit("shutdown")
@@ -279,6 +310,7 @@ class SignalGatewayAPI(ServiceBase):  # noqa
             asyncio.ensure_future(self.server.serve(), loop=self.loop),
             asyncio.ensure_future(self._update_robot(), loop=self.loop),
             asyncio.ensure_future(self._ws_server.run(), loop=self.loop),
+            asyncio.ensure_future(self.change_feed.run(), loop=self.loop),
             asyncio.ensure_future(self._cloud_api.run(), loop=self.loop),
             asyncio.ensure_future(self._oms_api.run(), loop=self.loop),
         ]
@@ -22,6 +22,8 @@ from copy import deepcopy
 
 from fastapi.routing import APIRoute
 from fastapi import Request
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
 from robosdk.common.exceptions import CloudError
 
 from server.orm.db import DataManage
@@ -33,7 +35,15 @@ from server.orm.models import CameraModel
 from server.orm.models import AppModel
 from server.orm.models import Architecture
 from server.orm.models import RoboAppEnvKey
+from server.orm.models import RoomManage
 from server.utils.utils import EventManager
+from server.utils.utils import decode_cursor
+from server.utils.utils import encode_cursor
+from server.utils.utils import etag_headers
+from server.utils.utils import etag_matches
+from server.utils.utils import make_etag
+from server.utils.utils import parse_fields
+from server.utils.utils import parse_limit
 from server.utils.cloud_apis import CloudOMSProxy
 
 from server.apis.__version__ import __version__ as version
@@ -66,6 +76,7 @@ class RobotAPI:
                 methods=["GET"],
                 summary="List all robots",
                 endpoint=self.list_robots,
+                response_class=ORJSONResponse,
             ),
             APIRoute(
                 path=f"{self.prefix}",
@@ -152,18 +163,21 @@ class RobotAPI:
 
     async def refresh_robots(self) -> List[RobotModel]:
         all_robots = []
-        exists_robot = []
-        _all_robots = await self.redis_client.get_all_robots()
+        oms_robots = [
+            robot for robot in self._oms.robots if robot.get("id", "")
+        ]
+        # one round trip for every robot known to oms
+        exists_robot = await self.redis_client.get_robots(
+            robot.get("id") for robot in oms_robots
+        )
         _all_deploy = self._oms.deployments
-        for robot in self._oms.robots:
-            # check if robot is in db
-            robot_id = robot.get("id", "")
-            if not robot_id:
-                continue
-            model = await self.redis_client.get_robot(robot_id)
-            if model is not None:
-                exists_robot.append(robot_id)
-            model = self._parse_robot_data(robot, model)
+        models = []
+        for robot in oms_robots:
+            exists = exists_robot.get(robot.get("id"))
+            # the cached robots are shared, change copies
+            model = self._parse_robot_data(
+                robot, exists and exists.copy(deep=True)
+            )
             if model.application:
                 for app, app_model in model.application.items():
                     if not app_model.app_deploy:
@@ -172,41 +186,87 @@ class RobotAPI:
                     status = deploy.get("status", "")
                     if status:
                         app_model.status = status
-            await self.redis_client.update_robot(robot_id, model)
+            models.append(model)
+        await self.redis_client.update_robots(models)
         # remove robot not in oms
-        for robot in _all_robots:
-            if robot.robot_id not in exists_robot:
-                await self.redis_client.delete_robot(robot.robot_id)
+        oms_robot_ids = {model.robot_id for model in models}
+        await self.redis_client.delete_robots(
+            robot_id for robot_id in await self.redis_client.get_robot_ids()
+            if robot_id not in oms_robot_ids
+        )
         return all_robots
 
-    async def list_robots(self):
+    async def list_robots(
+            self, request: Request, fields: Optional[str] = None,
+            limit: Optional[int] = None, cursor: Optional[str] = None
+    ):
         """
-        List all robots
+        List all robots, or a page of them in robot_id order when limit
+        or cursor is given. 304 when If-None-Match holds the ETag of
+        the robot list.
+        :param fields: comma separated robot fields to return, e.g.
+            robot_id,robot_name,status,service_id; all by default.
+        :param limit: the page size, 100 by default.
+        :param cursor: the next_cursor of the previous page.
         """
         self._event_bus.emit("list_robots")
-        robots = await self.redis_client.get_all_robots()
-        if not len(robots):
-            for robot in self._oms.robots:
-                model = self._parse_robot_data(robot)
-                if model is None:
-                    continue
-                robot_id = model.robot_id
-                await self.redis_client.update_robot(robot_id, model)
-                robots.append(model)
-        count = len(robots)
-        return {
-            "total": count,
-            "robots": robots
-        }
+        names = parse_fields(fields, RobotModel)
+        etag = make_etag(await self.redis_client.get_robots_version())
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=etag_headers(etag))
+        if limit is None and cursor is None:
+            robots = await self.redis_client.get_robot_rows(names)
+            if not len(robots) and await self._load_oms_robots():
+                robots = await self.redis_client.get_robot_rows(names)
+                etag = None
+            return ORJSONResponse({
+                "total": len(robots),
+                "robots": robots
+            }, headers=etag_headers(etag))
+        after = decode_cursor(cursor)
+        limit = parse_limit(limit)
+        total = await self.redis_client.count_robots()
+        if not (total or after) and await self._load_oms_robots():
+            total = await self.redis_client.count_robots()
+            etag = None
+        robots, last = await self.redis_client.get_robot_page(
+            names, after, limit
+        )
+        return ORJSONResponse({
+            "total": total,
+            "robots": robots,
+            "next_cursor": encode_cursor(last)
+        }, headers=etag_headers(etag))
+
+    async def _load_oms_robots(self) -> bool:
+        """Fill an empty robot store from OMS."""
+        models = []
+        for robot in self._oms.robots:
+            model = self._parse_robot_data(robot)
+            if model is None:
+                continue
+            models.append(model)
+        if models:
+            await self.redis_client.update_robots(models)
+        return bool(models)
 
-    async def get_robot(self, robot_id: str):
+    async def get_robot(
+            self, robot_id: str, request: Request, response: Response
+    ):
         """
-        Get robot by id
+        Get robot by id, 304 when If-None-Match holds its ETag
         """
         self._event_bus.emit("get_robot", robot_id=robot_id)
+        # read before the robot, a write in between only costs a refetch
+        etag = make_etag(await self.redis_client.get_version(
+            DataManage.REDIS_PREFIX_ROBOT + robot_id
+        ))
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=etag_headers(etag))
         robot = await self.redis_client.get_robot(robot_id)
         if robot is None:
             raise CloudError("robot not found", 404)
+        response.headers.update(etag_headers(etag))
         return robot
 
     async def start_teleop(
@@ -224,6 +284,8 @@ class RobotAPI:
             raise CloudError("robot or service not found", 404)
         if str(robot.status).lower() != "running":
             raise CloudError("robot status invalid", 400)
+        # the cached models are shared, change copies
+        service, robot = service.copy(deep=True), robot.copy(deep=True)
         if service.status == ServerStatus.active:
             return service
         if robot.service_id and robot.service_id != service_id:
@@ -231,11 +293,10 @@ class RobotAPI:
                 robot.service_id
             )
             if old_service:
-                old_service.status = ServerStatus.deleted
-                old_service.user_id = ""
-                await self.redis_client.update_service(
+                await self.redis_client.update_service_fields(
                     robot.service_id,
-                    old_service
+                    status=ServerStatus.deleted,
+                    user_id="",
                 )
         if service.user_id and service.user_id != robot.robot_id:
             raise CloudError(
@@ -250,9 +311,13 @@ class RobotAPI:
         robot.control_id = teleop_client
         robot.service_id = service_id
         service.user_id = robot.robot_id
+        # the listeners may add rooms and clients, see _save_service
+        rooms_before = deepcopy((service.rooms or {}).get("rooms", {}))
         self._event_bus.emit("app_create", service=service, robot=robot)
         await asyncio.sleep(.1)
-        robot.application = await self.deploy(robot, service)
+        robot.application = await self.deploy(
+            robot, service, rooms_before=rooms_before
+        )
         self.logger.debug(f"robot application: {robot.application}")
         await self.redis_client.update_robot(robot_id, robot)
         return service
@@ -260,7 +325,8 @@ class RobotAPI:
     async def deploy(
             self,
             robot: RobotModel,
-            service: ServiceModel
+            service: ServiceModel,
+            rooms_before: Optional[Dict] = None,
     ) -> Dict[str, AppModel]:
 
         service_id = robot.service_id
@@ -320,9 +386,45 @@ class RobotAPI:
                 )
             deploy[app.app_name] = app
         service.status = ServerStatus.active
-        await self.redis_client.update_service(service_id, service)
+        await self._save_service(service, rooms_before)
         return deploy
 
+    async def _save_service(
+            self, service: ServiceModel, rooms_before: Optional[Dict] = None
+    ):
+        """
+        Save a deployed service: its status and owner, and what the
+        app_create/app_deploy listeners changed in place, i.e. the
+        sparkrtc app and the rooms that differ from `rooms_before`.
+        The rooms are merged into the stored ones by compare-and-set.
+        """
+        fields = dict(status=service.status, user_id=service.user_id)
+        if "sparkrtc" in ServiceModel.__fields__:
+            # registered by the CloudRTC listener
+            fields["sparkrtc"] = getattr(service, "sparkrtc", None)
+        await self.redis_client.update_service_fields(
+            service.service_id, **fields
+        )
+        raw = service.rooms or {}
+        changed = {
+            name: room for name, room in raw.get("rooms", {}).items()
+            if (rooms_before or {}).get(name) != room
+        }
+        if not changed:
+            return
+
+        def merge(rtc: RoomManage):
+            rtc.update_from_json({
+                "rooms": changed,
+                "base_num": max(rtc.base_num, raw.get("base_num") or 0),
+            })
+
+        rooms, _ = await self.redis_client.modify_room_manage(
+            service.service_id, merge
+        )
+        if rooms is not None:
+            service.rooms = rooms.json()
+
     async def stop_teleop(
             self,
             robot_id: str,
@@ -337,6 +439,8 @@ class RobotAPI:
             raise CloudError("robot or service not found", 404)
         if service.status != ServerStatus.active:
             raise CloudError("Service already stopped", 400)
+        # the cached model is shared, change a copy
+        service = service.copy()
         if str(robot.status).lower() != "running":
             raise CloudError("robot status invalid", 400)
 
@@ -355,7 +459,9 @@ class RobotAPI:
         service.update_time = datetime.now().strftime(
             "%Y-%m-%d %H:%M:%S"
         )
-        await self.redis_client.update_service(service_id, service)
+        await self.redis_client.update_service_fields(
+            service_id, status=service.status, update_time=service.update_time
+        )
         self._event_bus.emit("app_stop", service=service, robot=robot)
         return service
 
@@ -17,7 +17,10 @@ from typing import List
 from datetime import datetime
 
 import uuid
+from fastapi import Request
+from fastapi import Response
 from fastapi.routing import APIRoute
+from fastapi.responses import ORJSONResponse
 from robosdk.common.exceptions import CloudError
 
 from server.orm.db import DataManage
@@ -28,6 +31,13 @@ from server.orm.models import RoomManage
 from server.orm.models import RoomModel
 from server.utils.utils import EventManager
 from server.utils.utils import gen_token
+from server.utils.utils import decode_cursor
+from server.utils.utils import encode_cursor
+from server.utils.utils import etag_headers
+from server.utils.utils import etag_matches
+from server.utils.utils import make_etag
+from server.utils.utils import parse_fields
+from server.utils.utils import parse_limit
 from server.apis.__version__ import __version__ as version
 
 
@@ -53,7 +63,8 @@ class ServerAPI:
                 methods=["GET"],
                 name="list_services",
                 tags=["service"],
-                summary="List all services"
+                summary="List all services",
+                response_class=ORJSONResponse,
             ),
             APIRoute(
                 path=f"{self.prefix}/" + "{service_id}",
@@ -119,16 +130,34 @@ class ServerAPI:
             ),
         ]
 
-    async def list_services(self):
+    async def list_services(
+            self, fields: Optional[str] = None,
+            limit: Optional[int] = None, cursor: Optional[str] = None
+    ):
         """
-        List all services
+        List all services, or a page of them in service_id order when
+        limit or cursor is given
+        :param fields: comma separated service fields to return, e.g.
+            service_id,status,update_time; all by default.
+        :param limit: the page size, 100 by default.
+        :param cursor: the next_cursor of the previous page.
         """
-        services = await self.redis_client.get_all_services()
+        names = parse_fields(fields, ServiceModel)
         self._event_bus.emit("list_services")
-        return {
-            "total": len(services),
-            "services": services
-        }
+        if limit is None and cursor is None:
+            services = await self.redis_client.get_service_rows(names)
+            return ORJSONResponse({
+                "total": len(services),
+                "services": services
+            })
+        services, last = await self.redis_client.get_service_page(
+            names, decode_cursor(cursor), parse_limit(limit)
+        )
+        return ORJSONResponse({
+            "total": await self.redis_client.count_services(),
+            "services": services,
+            "next_cursor": encode_cursor(last)
+        })
 
     async def get_service(self, service_id: str):
         """
@@ -170,18 +199,33 @@ class ServerAPI:
         service = await self.get_service(service_id)
         if service is None:
             raise CloudError("service not found", 404)
+        # the cached model is shared, change a copy
+        service = service.copy()
         self._event_bus.emit("delete_service", service=service)
         await self.redis_client.delete_service(service.service_id)
         return service
 
-    async def get_rooms(self, service_id: str):
+    async def get_rooms(
+            self, service_id: str, request: Request, response: Response
+    ):
         """
-        Get rooms by service id
+        Get rooms by service id, 304 when If-None-Match holds the ETag
+        of the service
         """
-        service = await self.get_service(service_id)
-        if service is None:
+        etag = make_etag(await self.redis_client.get_version(
+            DataManage.REDIS_PREFIX_SERVICE + service_id
+        ))
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=etag_headers(etag))
+        rooms = await self._get_room_manage(service_id)
+        response.headers.update(etag_headers(etag))
+        return rooms.json()
+
+    async def _get_room_manage(self, service_id: str) -> RoomManage:
+        rooms = await self.redis_client.get_room_manage(service_id)
+        if rooms is None:
             raise CloudError("service not found", 404)
-        return service.rooms
+        return rooms
 
     async def create_room(self, service_id: str, room: RoomModel):
         """
@@ -190,19 +234,19 @@ class ServerAPI:
         service = await self.get_service(service_id)
         if service is None:
             raise CloudError("service not found", 404)
-        rooms = RoomManage(service_id)
-        if service.rooms is None:
-            rooms.initial()
-        else:
-            rooms = rooms.update_from_json(service.rooms)
-        data = rooms.create_room(
-            room_id=room.room_id,
-            room_name=room.room_name,
-            room_type=room.room_type,
-            max_users=room.max_users,
+        # the cached model is shared, change a copy
+        service = service.copy()
+        rooms, data = await self.redis_client.modify_room_manage(
+            service_id, lambda rtc: rtc.create_room(
+                room_id=room.room_id,
+                room_name=room.room_name,
+                room_type=room.room_type,
+                max_users=room.max_users,
+            )
         )
+        if rooms is None:
+            raise CloudError("service not found", 404)
         service.rooms = rooms.json()
-        await self.redis_client.update_service(service_id, service)
         self._event_bus.emit("create_room", service=service, room=room)
         return data
 
@@ -210,15 +254,7 @@ class ServerAPI:
         """
         Get room by service id and room id
         """
-        service = await self.get_service(service_id)
-        if service is None:
-            raise CloudError("service not found", 404)
-        rooms = RoomManage(service_id)
-        if service.rooms is None:
-            rooms.initial()
-        else:
-            rooms = rooms.update_from_json(service.rooms)
-
+        rooms = await self._get_room_manage(service_id)
         if str(room_id).isdigit():
             data = rooms.get_room(room_id=int(room_id), room_name=room_id)
         else:
@@ -232,16 +268,21 @@ class ServerAPI:
         service = await self.get_service(service_id)
         if service is None:
             raise CloudError("service not found", 404)
-        rooms = RoomManage(service_id)
-        if service.rooms is None:
-            rooms.initial()
-        else:
-            rooms = rooms.update_from_json(service.rooms)
-        if str(room_id).isdigit():
-            data = rooms.delete_room(room_id=int(room_id), room_name=room_id)
-        else:
-            data = rooms.delete_room(room_name=room_id)
+        # the cached model is shared, change a copy
+        service = service.copy()
+
+        def delete(rtc: RoomManage) -> Optional[str]:
+            if str(room_id).isdigit():
+                return rtc.delete_room(
+                    room_id=int(room_id), room_name=room_id
+                )
+            return rtc.delete_room(room_name=room_id)
+
+        rooms, data = await self.redis_client.modify_room_manage(
+            service_id, delete
+        )
+        if rooms is None:
+            raise CloudError("service not found", 404)
         service.rooms = rooms.json()
         self._event_bus.emit("delete_room", service=service, room_id=room_id)
-        await self.redis_client.update_service(service_id, service)
         return data
@@ -12,16 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+import uuid
+import heapq
 import asyncio
+import inspect
 import datetime
-import itertools
+from urllib.parse import parse_qs
+from typing import Any
+from typing import Callable
 from typing import Optional
+from typing import Tuple
 from typing import Union
 from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import Set
 from enum import Enum
 
 import socketio
+from socketio.exceptions import ConnectionRefusedError
 
 from server.orm.models import ServiceModel
 from server.orm.models import ServerStatus
@@ -29,6 +39,8 @@ from server.orm.models import RoomManage
 from server.orm.models import RoomModel
 from server.orm.models import RoomClient
 from server.orm.db import DataManage
+from server.utils import metrics
+from server.utils.routing import HashRing
 
 
 class SocketEvents(Enum):
@@ -55,12 +67,44 @@ class SocketEvents(Enum):
     PEER_CALL = "call-peer"
     PEER_CALL_ICE_CANDIDATE = "send-ice-candidate"
     CLOSE_ALL = "close-all-room-peer-connections"
+    REPORT_STATS = "report-link-stats"
+
+
+PUBLISHER_TYPES = ("publisher", "robot")
+
+
+def _is_publisher(client: RoomClient) -> bool:
+    return (
+        client.client_type in PUBLISHER_TYPES or
+        client.client_role == "robot"
+    )
+
+
+def plan_peer_calls(clients: Iterable[RoomClient]) -> Dict[str, List[str]]:
+    """
+    Plan the peer connections of the clients of a room as
+    {caller: [callee, ...]}. With publishers (robots) and other clients
+    in the room, it is a star: every publisher calls every other client
+    and the others do not call each other. Otherwise every client calls
+    the ones after it.
+    """
+    clients = sorted(clients, key=lambda c: c.client_id)
+    hubs = [c.client_id for c in clients if _is_publisher(c)]
+    spokes = [c.client_id for c in clients if not _is_publisher(c)]
+    if hubs and spokes:
+        return {hub: list(spokes) for hub in hubs}
+    ids = hubs or spokes
+    return {_id: ids[inx + 1:] for inx, _id in enumerate(ids[:-1])}
 
 
 class WebRTCGatewayWSServer:
     DISCONNECT_DELAY_S = 1
-    INACTIVE_DELAY_S = 30
+    INACTIVE_TTL = datetime.timedelta(hours=2)
+    HEARTBEAT_S = 10
     PING_TIME_OUT = 60
+    MAX_LINK_WORKERS = 32  # worker series a robot may report
+    # writes to a service within this window share one expiry check
+    CHANGE_CHECK_S = 10
 
     def __init__(
             self,
@@ -68,17 +112,44 @@ class WebRTCGatewayWSServer:
             redis_client: DataManage,
             async_mode: str = "asgi",
             cors_allowed_origins: Union[str, list] = '*',
+            client_manager: Optional[socketio.AsyncManager] = None,
+            advertise_url: str = "",
     ):
+        """
+        :param client_manager: The socket.io client manager, e.g. a
+            socketio.AsyncRedisManager to run several gateway workers;
+            defaults to the in-process manager.
+        :param advertise_url: The url clients reach this worker at. When
+            set, clients asking for affinity are redirected to the worker
+            their service lives on. It must reach this worker only: run
+            one gateway process per url, e.g. one port per process.
+        """
 
         self.logger = logger
         self._sio = socketio.AsyncServer(
             async_mode=async_mode,
             ping_timeout=self.PING_TIME_OUT,
-            cors_allowed_origins=cors_allowed_origins
+            cors_allowed_origins=cors_allowed_origins,
+            client_manager=client_manager,
         )
+        # sessions of this worker, the ones of every worker are in Redis
         self._services: Dict[str, ServiceModel] = {}
+        # last rooms seen per service, the shared ones are in Redis
         self._rooms: Dict[str, RoomManage] = {}  # service_id: RoomManage
+        self._link_stats: Dict[str, Dict] = {}  # service_id: {worker: stats}
+        self._link_reporters: Dict[str, str] = {}  # service_id: robot sid
         self._redis_client = redis_client
+        self.replica_id = uuid.uuid4().hex
+        self.advertise_url = advertise_url
+        # workers clients can be redirected to, by consistent hashing
+        self._ring = HashRing()
+        self._replica_urls: Dict[str, str] = {}
+        self._shared_urls: Set[str] = set()  # warned about, see below
+        # services to check for expiry, at monotonic deadlines
+        self._deadlines: Dict[str, float] = {}
+        self._expiry: List[Tuple[float, str]] = []
+        self._expiry_changed: Optional[asyncio.Event] = None
+        redis_client.add_invalidation_listener(self._on_invalidate)
         self._should_exit = False
 
     @property
@@ -87,77 +158,196 @@ class WebRTCGatewayWSServer:
         return self._sio
 
     def initial(self):
-        self.sio.on(SocketEvents.CONNECT.value, self.on_connect)
-        self.sio.on(SocketEvents.DISCONNECT.value, self.disconnect)
+        handlers = {
+            SocketEvents.CONNECT: self.on_connect,
+            SocketEvents.DISCONNECT: self.disconnect,
+            SocketEvents.JOIN_ROOM: self.join_rtc_room,
+            SocketEvents.LEVE_ROOM: self.leave_rtc_room,
+            SocketEvents.PEER_CALL_ICE_CANDIDATE: self.ice_candidate,
+            SocketEvents.MAKE_PEER_CALL_ANSWER: self.make_call_answer,
+            SocketEvents.CALL_ALL: self.call_all,
+            SocketEvents.PEER_CALL: self.call_peer,
+            SocketEvents.CALL: self.call_ids,
+            SocketEvents.CLOSE_ALL: self.close,
+            SocketEvents.REPORT_STATS: self.report_stats,
+        }
+        for event, handler in handlers.items():
+            self.sio.on(
+                event.value, metrics.track_event(event.value, handler)
+            )
 
-        self.sio.on(SocketEvents.JOIN_ROOM.value, self.join_rtc_room)
-        self.sio.on(SocketEvents.LEVE_ROOM.value, self.leave_rtc_room)
-        self.sio.on(
-            SocketEvents.PEER_CALL_ICE_CANDIDATE.value, self.ice_candidate
-        )
-        self.sio.on(
-            SocketEvents.MAKE_PEER_CALL_ANSWER.value, self.make_call_answer
-        )
-        self.sio.on(SocketEvents.CALL_ALL.value, self.call_all)
-        self.sio.on(SocketEvents.PEER_CALL.value, self.call_peer)
-        self.sio.on(SocketEvents.CALL.value, self.call_ids)
-        self.sio.on(SocketEvents.CLOSE_ALL.value, self.close)
+    def collect_metrics(self):
+        """Refresh the gauges of services, rooms and participants."""
+        rooms = 0
+        participants = 0
+        for room_manage in self._rooms.values():
+            rooms += room_manage.active_rooms
+            participants += room_manage.participant_total
+        metrics.ACTIVE_SERVICES.set(len(self._rooms))
+        metrics.CONNECTED_CLIENTS.set(len(self._services))
+        metrics.ACTIVE_ROOMS.set(rooms)
+        metrics.ACTIVE_PARTICIPANTS.set(participants)
 
     async def run(self):
         self.initial()
-        await self.sio.start_background_task(self.self_check)
+        self.sio.start_background_task(self.heartbeat)
+        await self.sio.start_background_task(self.expire_services)
 
-    async def self_check(self):
+    async def heartbeat(self):
         while 1:
             if self._should_exit:
                 break
-            await asyncio.sleep(self.INACTIVE_DELAY_S)
-            try:
-                await self._check_inactive()
-            except Exception as e:
-                self.logger.error(f"check inactive error {e}")
             try:
-                await self._check_disconnect()
+                await self._redis_client.register_replica(
+                    self.replica_id, self.advertise_url
+                )
+                await self._refresh_replicas()
+                await self._reap_replicas()
             except Exception as e:
-                self.logger.error(f"check disconnect error {e}")
-
-    async def _check_inactive(self):
-        remove_service_ids = []
+                self.logger.error(f"register replica error {e}")
+            await asyncio.sleep(self.HEARTBEAT_S)
 
-        for service_id, room_manage in self._rooms.items():
-            # get service last active time
-            service = await self._redis_client.get_service(service_id)
-            if not service:
-                remove_service_ids.append(service_id)
-                continue
-            _client = self.sio.manager.rooms["/"].get(
-                service.service_id, {}
-            ).keys()
-            if len(_client) > 0:
-                continue
+    async def expire_services(self):
+        """Remove the services whose expiry deadline passed."""
+        self._expiry_changed = asyncio.Event()
+        while 1:
+            if self._should_exit:
+                break
+            now = time.monotonic()
+            while self._expiry and self._expiry[0][0] <= now:
+                deadline, service_id = heapq.heappop(self._expiry)
+                if self._deadlines.get(service_id) != deadline:
+                    continue  # rescheduled
+                del self._deadlines[service_id]
+                try:
+                    await self._check_expiry(service_id)
+                except Exception as e:
+                    self.logger.error(f"check inactive error {e}")
+                    # try again later rather than never
+                    self._schedule_expiry(service_id, self.CHANGE_CHECK_S)
+                now = time.monotonic()
+            timeout = self._expiry[0][0] - now if self._expiry else None
+            self._expiry_changed.clear()
+            try:
+                await asyncio.wait_for(self._expiry_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _schedule_expiry(self, service_id: str, delay: float = 0):
+        """Check a service for expiry in `delay` seconds, or earlier."""
+        deadline = time.monotonic() + delay
+        current = self._deadlines.get(service_id)
+        if current is not None and current <= deadline:
+            return
+        self._deadlines[service_id] = deadline
+        heapq.heappush(self._expiry, (deadline, service_id))
+        if len(self._expiry) > 2 * len(self._deadlines) + 64:
+            # drop the entries of rescheduled services
+            self._expiry = [(d, s) for s, d in self._deadlines.items()]
+            heapq.heapify(self._expiry)
+        if self._expiry_changed is not None:
+            self._expiry_changed.set()
+
+    def _on_invalidate(self, key: str):
+        # a service written or deleted on any worker. Only a delete needs
+        # a check soon, a pending check already picks up a later
+        # update_time, so the writes within CHANGE_CHECK_S, e.g. the
+        # update_time touch of every connect, share a single check.
+        prefix = DataManage.REDIS_PREFIX_SERVICE
+        if key.startswith(prefix) and key[len(prefix):] in self._rooms:
+            self._schedule_expiry(key[len(prefix):], self.CHANGE_CHECK_S)
+
+    async def _check_expiry(self, service_id: str):
+        service = await self._redis_client.get_service(service_id)
+        if service:
+            if await self._redis_client.count_online(service_id) > 0:
+                # checked again when its last client leaves
+                return
+            if not getattr(service, "update_time", None):
+                return
             update_time = datetime.datetime.strptime(
                 service.update_time, "%Y-%m-%d %H:%M:%S"
-            ) if getattr(service, "update_time", None) else None
-            # if service is inactive or update_time is 2 hours ago
-            if update_time and (datetime.datetime.now() - update_time
-                                > datetime.timedelta(hours=2)):
-                self.logger.debug(f"service {service_id} is inactive")
-                remove_service_ids.append(service_id)
-        for service_id in remove_service_ids:
-            await self._redis_client.delete_service(service_id)
-            self._rooms.pop(service_id)
-
-    async def _check_disconnect(self):
-        remove_sids = []
-        for sid, server in self._services.items():
-            if server.service_id not in self._rooms:
-                # service is inactive, disconnect all clients
-                self.logger.debug(
-                    f"service {server.service_id} is inactive")
-                await self.sio.disconnect(sid)
-                remove_sids.append(sid)
-        for sid in remove_sids:
-            self._services.pop(sid)
+            )
+            # the service is inactive 2 hours after its last update
+            left = update_time + self.INACTIVE_TTL - datetime.datetime.now()
+            if left.total_seconds() > 0:
+                self._schedule_expiry(service_id, left.total_seconds())
+                return
+            self.logger.debug(f"service {service_id} is inactive")
+        await self._expire(service_id)
+
+    async def _expire(self, service_id: str):
+        # disconnect the clients of the service on this worker
+        for sid, server in list(self._services.items()):
+            if server.service_id != service_id:
+                continue
+            await self.sio.disconnect(sid)
+            self._services.pop(sid, None)
+            await self._redis_client.remove_session(sid, self.replica_id)
+        await self._redis_client.delete_service(service_id)
+        self._rooms.pop(service_id, None)
+        self._deadlines.pop(service_id, None)
+        self._drop_link_stats(service_id)
+
+    async def _refresh_replicas(self):
+        """
+        Put the live workers clients can reach on the hash ring. A url
+        shared by several workers cannot reach one of them in particular,
+        so only the first of them by replica id is kept.
+        """
+        replicas = await self._redis_client.get_replicas()
+        urls: Dict[str, str] = {}
+        for replica_id, url in sorted(replicas.items()):
+            if not url:
+                continue
+            if url in urls.values():
+                if url not in self._shared_urls:
+                    self._shared_urls.add(url)
+                    self.logger.warning(
+                        f"replica {replica_id} shares {url} with another "
+                        f"one, run one gateway process per url"
+                    )
+                continue
+            urls[replica_id] = url
+        self._replica_urls = urls
+        self._ring.update(self._replica_urls)
+
+    async def _route(self, service_id: str) -> str:
+        """
+        Get the url of the worker the clients of a service should use,
+        empty when it is this worker or routing is off. A service stays
+        on its home worker while that one lives, so added workers only
+        take new services or the ones that went idle; the services of a
+        lost worker move to their owner on the ring.
+        """
+        if not (self.advertise_url and len(self._replica_urls) > 1):
+            return ""
+        home = await self._redis_client.get_home(service_id)
+        if home not in self._replica_urls:
+            owner = self._ring.get(service_id) or self.replica_id
+            home = await self._redis_client.set_home(
+                service_id, owner, force=home is not None
+            )
+        url = self._replica_urls.get(home, "")
+        if home == self.replica_id or url == self.advertise_url:
+            # a redirect to the url the client used may land here again
+            return ""
+        return url
+
+    @staticmethod
+    def _wants_affinity(env) -> bool:
+        query = parse_qs(env.get("QUERY_STRING", ""))
+        return query.get("affinity", [""])[0] in ("1", "true")
+
+    async def _reap_replicas(self):
+        """Remove the clients of dead workers from the rooms."""
+        dropped = await self._redis_client.reap_replicas()
+        for service_id, sids in dropped.items():
+            self.logger.info(f"drop {len(sids)} stale clients of {service_id}")
+            await self._modify_rooms(
+                service_id, lambda rtc: [rtc.kcick(sid) for sid in sids]
+            )
+            self._schedule_expiry(service_id)
 
     async def on_connect(self, sid: str, env):
         self.logger.debug(f"Client {sid} connected")
@@ -170,62 +360,123 @@ class WebRTCGatewayWSServer:
         ):
             self.logger.error(f"inactive Service {service_id}")
             return
+        if self._wants_affinity(env):
+            url = await self._route(service_id)
+            if url:
+                self.logger.debug(f"redirect client {sid} to {url}")
+                raise ConnectionRefusedError("redirect", {"url": url})
+        # the cached model is shared, change a copy
+        server = server.copy()
         server.update_time = datetime.datetime.now().strftime(
             "%Y-%m-%d %H:%M:%S"
         )
-        await self._redis_client.update_service(service_id, server)
+        await self._redis_client.update_service_fields(
+            service_id, update_time=server.update_time
+        )
         # join service room
-        self.sio.enter_room(sid, service_id)
+        await self._enter_room(sid, service_id)
         self._services[sid] = server
-        if service_id not in self._rooms:
-            self._rooms[service_id] = RoomManage(
-                service_id=service_id,
-            )
-            self._rooms[service_id].update_from_json(server.rooms)
+        await self._redis_client.add_session(sid, service_id, self.replica_id)
+        rooms = await self._redis_client.get_ws_rooms(service_id)
+        if rooms is None:
+            # first client of the service on any worker
+            rooms, _ = await self._modify_rooms(service_id, lambda rtc: None)
+        self._rooms[service_id] = rooms
         self.logger.debug(f"Client {sid} connected {service_id}")
 
     async def disconnect(self, sid: str):
         self.logger.debug(f"Client {sid} disconnected")
-        rtc = self._get_rtc_room(sid)
-        if not rtc:
+        server: ServiceModel = self._services.pop(sid, None)
+        service_id = await self._redis_client.remove_session(
+            sid, self.replica_id
+        )
+        service_id = service_id or getattr(server, "service_id", "")
+        if not service_id:
             return
 
         try:
-            self.logger.debug(f"Client {sid} disconnect {rtc.service_id}")
-            self.sio.leave_room(sid, rtc.service_id)
+            self.logger.debug(f"Client {sid} disconnect {service_id}")
+            await self._leave_room(sid, service_id)
             await self.sio.disconnect(sid)
         except Exception as e:
             self.logger.debug(f"disconnect error {e}")
         finally:
-            rtc.kcick(sid)
+            await self._modify_rooms(service_id, lambda rtc: rtc.kcick(sid))
+        if self._link_reporters.get(service_id) == sid:
+            # the robot reporting the link quality is gone
+            self._drop_link_stats(service_id)
+        if not await self._redis_client.count_online(service_id):
+            # an idle service may move to its owner on the ring
+            await self._redis_client.clear_home(service_id)
+            self._schedule_expiry(service_id)
+
+    @staticmethod
+    def _room_key(service_id: str, room_id: int) -> str:
+        """The socket.io room of the clients of an RTC room."""
+        return f"{service_id}/{room_id}"
+
+    async def _enter_room(self, sid: str, room: str):
+        # a coroutine since python-socketio 5.10
+        ret = self.sio.enter_room(sid, room)
+        if inspect.isawaitable(ret):
+            await ret
+
+    async def _leave_room(self, sid: str, room: str):
+        ret = self.sio.leave_room(sid, room)
+        if inspect.isawaitable(ret):
+            await ret
+
+    async def _get_service_id(self, sid: str) -> str:
+        """Get the service of a client connected to any worker."""
+        server: ServiceModel = self._services.get(sid)
+        if server is not None:
+            return server.service_id
+        return await self._redis_client.get_session(sid) or ""
 
-    def _get_rtc_room(self, sid: str) -> Optional[RoomManage]:
+    async def _get_rtc_room(self, sid: str) -> Optional[RoomManage]:
         server: ServiceModel = self._services.get(sid)
         if not server:
             return
-        return self._rooms.get(server.service_id)
-
-    def _get_rtc_room_online_clients(
-            self, room: RoomModel, service_id: str,
-            exclude_sid: List[str] = None
+        rooms = await self._redis_client.get_ws_rooms(server.service_id)
+        if rooms is not None:
+            self._rooms[server.service_id] = rooms
+        return rooms
+
+    async def _modify_rooms(
+            self, service_id: str, func: Callable[[RoomManage], Any]
+    ) -> Tuple[RoomManage, Any]:
+        rooms, result = await self._redis_client.modify_ws_rooms(
+            service_id, func
+        )
+        self._rooms[service_id] = rooms
+        return rooms, result
+
+    def _get_room_participants(
+            self, room: RoomModel, service_id: str
+    ) -> List[RoomClient]:
+        rtc = self._rooms.get(service_id)
+        if rtc is None:
+            return room.participants_list or []
+        return rtc.get_participants(room)
+
+    async def _get_rtc_room_online_clients(
+            self, room: RoomModel, service_id: str
     ):
-        _client = list(self.sio.manager.rooms["/"].get(service_id, {}).keys())
+        _client = await self._redis_client.get_online(service_id)
         participants = []
-        for s in room.participants_list:
+        for s in self._get_room_participants(room, service_id):
             if s.client_id not in _client:
                 self.logger.info(
                     f'remove_inactive_user: {s.client_id} from {room.room_name}'
                 )
                 continue
-            if exclude_sid and s.client_id in exclude_sid:
-                continue
             participants.append(s)
         return participants
 
     async def join_rtc_room(self, sid: str, data: Dict) -> str:
         self.logger.debug(f"Client {sid} join room {data}")
-        rtc_ = self._get_rtc_room(sid)
-        if not rtc_:
+        server: ServiceModel = self._services.get(sid)
+        if not server:
             self.logger.error(f"client {sid} never connected")
             return ""
         room_name = data.get("room", "")
@@ -237,65 +488,84 @@ class WebRTCGatewayWSServer:
             self.logger.error(f"join room {data} error")
             return ""
 
-        if not len(rtc_.rooms):
-            rtc_.initial()
-        rtc_room = rtc_.get_room(room_name=room_name, room_id=room_id)
-        if not rtc_room:
-            self.logger.error(f"room {room_name} invalid")
-            return ""
-
         client = RoomClient(
             client_id=sid,
             client_name=client_name,
             client_type=client_type,
             client_role=client_role
         )
-        rtc_.join_room(rtc_room, client)
-        data = []
-        all_ids = []
-        for r in self._get_rtc_room_online_clients(
-                rtc_room, rtc_.service_id
-        ):
-            data.append(
-                {
-                    "id": r.client_id,
-                    "name": r.client_name,
-                    "type": r.client_type,
-                }
+
+        def join(rtc: RoomManage) -> Optional[RoomModel]:
+            if not len(rtc.rooms):
+                rtc.initial()
+            room = rtc.get_room(room_name=room_name, room_id=room_id)
+            if room:
+                rtc.join_room(room, client)
+            return room
+
+        _, rtc_room = await self._modify_rooms(server.service_id, join)
+        if not rtc_room:
+            self.logger.error(f"room {room_name} invalid")
+            return ""
+        await self._enter_room(
+            sid, self._room_key(server.service_id, rtc_room.room_id)
+        )
+
+        data = [
+            {
+                "id": r.client_id,
+                "name": r.client_name,
+                "type": r.client_type,
+            }
+            for r in await self._get_rtc_room_online_clients(
+                rtc_room, server.service_id
             )
-            all_ids.append(r.client_id)
+        ]
         await self.send_json(
-            SocketEvents.ROOM_CLIENTS.value, rtc_room, data, all_ids)
+            SocketEvents.ROOM_CLIENTS.value, rtc_room, data,
+            server.service_id
+        )
         self.logger.info(
             f"Client {client_name} join room {rtc_room.room_name}")
         return sid
 
     async def leave_rtc_room(self, sid: str, data: Dict) -> bool:
         self.logger.debug(f"Client {sid} leave room {data}")
-        rtc_ = self._get_rtc_room(sid)
-        if not rtc_:
+        server: ServiceModel = self._services.get(sid)
+        if not server:
             self.logger.error(f"client {sid} never connected")
             return False
         room = data.get("room", "")
         room_id = data.get("roomId", "")
-        rtc_room = rtc_.get_room(room_name=room, room_id=room_id)
+
+        def leave(rtc: RoomManage) -> Optional[RoomModel]:
+            _room = rtc.get_room(room_name=room, room_id=room_id)
+            if _room:
+                rtc.leave_room(_room, sid)
+            return _room
+
+        _, rtc_room = await self._modify_rooms(server.service_id, leave)
         if not rtc_room:
             self.logger.error(f"room {room} invalid")
             return False
+        await self._leave_room(
+            sid, self._room_key(server.service_id, rtc_room.room_id)
+        )
 
-        rtc_.leave_room(rtc_room, sid)
         _data = [
             {
                 "id": r.client_id,
                 "name": r.client_name,
                 "type": r.client_type,
             }
-            for r in self._get_rtc_room_online_clients(
-                rtc_room, rtc_.service_id
+            for r in await self._get_rtc_room_online_clients(
+                rtc_room, server.service_id
             )
         ]
         await self.send_json(
-            SocketEvents.ROOM_CLIENTS.value, rtc_room, _data)
+            SocketEvents.ROOM_CLIENTS.value, rtc_room, _data,
+            server.service_id
+        )
         self.logger.info(f"Client {sid} leave room {rtc_room.room_name}")
         return True
 
@@ -303,19 +573,21 @@ class WebRTCGatewayWSServer:
                         event: str,
                         room: RoomModel,
                         data: Union[Dict, List],
-                        to_id: Optional[List[str]] = None):
+                        service_id: str,
+                        skip_sid: Optional[str] = None):
+        """
+        Send an event to every client of an RTC room, on any worker, in
+        one emit to the socket.io room of the RTC room. `service_id` is
+        the service the clients connected to; rooms saved by older
+        releases carry no or a wrong service_id of their own.
+        """
         if not event:
             return
-        if not to_id:
-            to_id = [r.client_id for r in room.participants_list]
-        if not len(to_id):
-            return
-        tasks = []
-        for sid in to_id:
-            tasks.append(
-                self._sio.emit(event, data, to=sid, room=room.service_id)
-            )
-        await asyncio.wait(tasks)
+        await self._sio.emit(
+            event, data,
+            room=self._room_key(service_id, room.room_id),
+            skip_sid=skip_sid
+        )
 
     async def _call_client(self, from_id: str, data: Dict, event: str):
         to_id = data.get("toId", "")
@@ -324,17 +596,13 @@ class WebRTCGatewayWSServer:
         if to_id == from_id:
             return
         from_service: ServiceModel = self._services.get(from_id, "")
-        to_service: ServiceModel = self._services.get(to_id, "")
         service_id = getattr(from_service, "service_id", "")
+        # the callee may be connected to another worker
         if not (
                 service_id and
-                service_id == getattr(to_service, "service_id", "")
+                service_id == await self._get_service_id(to_id)
         ):
             return
-        _rtc: RoomManage = self._rooms.get(service_id)
-        if _rtc is None:
-            self.logger.error(f"client {from_id} never connected")
-            return
         data['fromId'] = from_id
         self.logger.debug(f'{event}: {data} - from {from_id}')
         await self.sio.emit(
@@ -365,74 +633,115 @@ class WebRTCGatewayWSServer:
             self.logger.error(f"client {from_id} never connected")
             return
         service_id = server.service_id
-        _rtc: RoomManage = self._get_rtc_room(from_id)
+        _rtc: RoomManage = await self._get_rtc_room(from_id)
+        if _rtc is None:
+            return
         all_rooms = _rtc.get_room_of_client(from_id)
-        _client = self.sio.manager.rooms["/"].get(service_id, {}).keys()
-        tasks = []
+        _client = await self._redis_client.get_online(service_id)
+        plan: Dict[str, Dict[str, None]] = {}
         for room_name in all_rooms:
             room = _rtc.get_room_by_name(room_name)
-            if room is not None:
-                all_client = [
-                    r.client_id for r in room.participants_list
-                ]
-                tmp_ids = list(set(_client) & set(all_client))
-                if not len(tmp_ids):
-                    continue
-                tasks.append(
-                    self.call_ids(from_id, list(tmp_ids))
-                )
-            else:
+            if room is None:
                 self.logger.debug(f"room {room_name} not found")
                 continue
-        if len(tasks) == 0:
-            return
-        await asyncio.wait(tasks)
+            clients = [
+                r for r in _rtc.get_participants(room)
+                if r.client_id in _client
+            ]
+            for caller, callees in plan_peer_calls(clients).items():
+                plan.setdefault(caller, {}).update(dict.fromkeys(callees))
+        await self._make_peer_calls(
+            {caller: list(callees) for caller, callees in plan.items()}
+        )
 
     async def call_ids(self, from_id: str, ids: List):
-        _rtc: RoomManage = self._get_rtc_room(from_id)
+        _rtc: RoomManage = await self._get_rtc_room(from_id)
         if _rtc is None:
             self.logger.error(f"client {from_id} never connected")
             return
+        await self._call_ids(from_id, ids, _rtc)
 
-        ids = list(set(ids) & set(_rtc.participants.keys()) - {from_id})
-        self.logger.debug(f'call-id {from_id} - {ids}')
+    async def _call_ids(self, from_id: str, ids: List, _rtc: RoomManage):
         # make sure fromId be called
-        ids.append(from_id)
-        if len(ids) < 2:
+        clients = [
+            next(iter(_rtc.participants.get(_id, {}).values()), None)
+            for _id in set(ids) | {from_id}
+        ]
+        clients = [client for client in clients if client is not None]
+        self.logger.debug(f'call-id {from_id} - {ids}')
+        if len(clients) < 2:
             return
-        combinations = itertools.combinations(ids, 2)
-        tasks = []
-        for _id in ids:
-            ids_to_call = [c[1] for c in combinations if c[0] == _id]
-            if len(ids_to_call) == 0:
-                continue
-            tasks.append(
-                self.sio.emit(
-                    SocketEvents.MAKE_PEER_CALL.value,
-                    ids_to_call,
-                    to=_id
-                )
+        await self._make_peer_calls(plan_peer_calls(clients))
+
+    async def _make_peer_calls(self, plan: Dict[str, List[str]]):
+        """Send every caller of the plan one make-peer-call."""
+        tasks = [
+            self.sio.emit(
+                SocketEvents.MAKE_PEER_CALL.value, callees, to=caller
             )
-        await asyncio.gather(*tasks)
+            for caller, callees in plan.items() if callees
+        ]
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    def get_link_stats(self, service_id: str) -> Dict:
+        return self._link_stats.get(service_id, {})
+
+    def _drop_link_stats(self, service_id: str):
+        self._link_reporters.pop(service_id, None)
+        for worker in self._link_stats.pop(service_id, {}):
+            metrics.remove_link_stats(service_id, worker)
+
+    def _is_robot(self, sid: str, service_id: str) -> bool:
+        """Whether a client joined a room of its service as a robot."""
+        rtc = self._rooms.get(service_id)
+        return rtc is not None and any(
+            _is_publisher(client)
+            for client in rtc.get_room_of_client(sid).values()
+        )
+
+    async def report_stats(self, from_id: str, data: Dict):
+        server: ServiceModel = self._services.get(from_id)
+        if not server:
+            self.logger.error(f"client {from_id} never connected")
+            return
+        service_id = server.service_id
+        if not self._is_robot(from_id, service_id):
+            self.logger.debug(f"drop link stats of non robot {from_id}")
+            return
+        workers = data.get("workers") if isinstance(data, dict) else None
+        if not isinstance(workers, dict):
+            return
+        report = {
+            worker: metrics.clean_link_stats(stats)
+            for worker, stats in workers.items()
+            if isinstance(worker, str) and isinstance(stats, dict)
+        }
+        if len(report) > self.MAX_LINK_WORKERS:
+            report = dict(sorted(report.items())[:self.MAX_LINK_WORKERS])
+        for worker in set(self._link_stats.get(service_id, {})) - set(report):
+            metrics.remove_link_stats(service_id, worker)
+        self._link_stats[service_id] = report
+        self._link_reporters[service_id] = from_id
+        for worker, stats in report.items():
+            metrics.set_link_stats(service_id, worker, stats)
 
     async def close(self, from_id):
         self.logger.debug(f'close by {from_id}')
-        self._should_exit = True
 
-        _rtc = self._get_rtc_room(from_id)
+        server: ServiceModel = self._services.get(from_id)
+        _rtc = await self._get_rtc_room(from_id)
         if _rtc is None:
             self.logger.error(f"client {from_id} never connected")
             return
         data = {}
         for room_name, client in _rtc.get_room_of_client(from_id).items():
             room = _rtc.get_room(room_name=room_name)
-            all_client = self._get_rtc_room_online_clients(
-                room, _rtc.service_id, exclude_sid=[from_id]
-            )
-            all_client_id = [r.client_id for r in all_client]
+            if room is None:
+                continue
             await self.send_json(
                 SocketEvents.PEER_CALL_CLOSE.value,
-                room, data, all_client_id
+                room, data, server.service_id, skip_sid=from_id
             )
 
         await self.disconnect(from_id)
@@ -12,17 +12,216 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import hashlib
+import functools
 import traceback
+import uuid
+from enum import Enum
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import Generic
+from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Type
+from typing import TypeVar
+from typing import Union
 
+import orjson
+from cachetools import TTLCache
+from pydantic import BaseModel
+from pydantic.fields import ModelField
+from pydantic.fields import SHAPE_DICT
+from pydantic.fields import SHAPE_LIST
+from pydantic.fields import SHAPE_MAPPING
+from pydantic.fields import SHAPE_SINGLETON
+from pydantic.json import pydantic_encoder
 from redis import asyncio as aioredis
+from redis.exceptions import ResponseError
+from redis.exceptions import WatchError
 from injector import singleton
 from injector import inject
 
 from server.orm.models import ServiceModel
 from server.orm.models import RobotModel
 from server.orm.models import RoomModel
+from server.orm.models import RoomManage
+from server.utils.metrics import timed_redis
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def _digest(mapping: Dict[str, str]) -> str:
+    """Digest of an encoded hash, the same for the same content."""
+    return hashlib.blake2b(
+        orjson.dumps(mapping, option=orjson.OPT_SORT_KEYS), digest_size=12
+    ).hexdigest()
+
+
+def construct(model: Type[M], data: Dict[str, Any]) -> M:
+    """
+    Build a model from data this service wrote itself, without
+    validation. Nested models and enums are still rebuilt from their
+    JSON form; anything else is taken as it is, so never use this on
+    data from a request.
+    """
+    plan = _CONSTRUCT_PLANS.get(model)
+    if plan is None:
+        plan = _CONSTRUCT_PLANS[model] = {
+            name: (field, _converter(field))
+            for name, field in model.__fields__.items()
+        }
+    values = {}
+    fields_set = set()
+    for name, (field, convert) in plan.items():
+        if name not in data:
+            values[name] = field.get_default()
+            continue
+        value = data[name]
+        if convert is not None and value is not None:
+            value = convert(value)
+        values[name] = value
+        fields_set.add(name)
+    # what BaseModel.construct does, without its per call overhead
+    instance = model.__new__(model)
+    object.__setattr__(instance, "__dict__", values)
+    object.__setattr__(instance, "__fields_set__", fields_set)
+    return instance
+
+
+def _converter(field: ModelField) -> Optional[Callable[[Any], Any]]:
+    """How to rebuild the JSON form of a field, None to keep it."""
+    _type = field.type_
+    if not isinstance(_type, type):
+        return
+    if issubclass(_type, BaseModel):
+        if field.shape == SHAPE_SINGLETON:
+            return functools.partial(construct, _type)
+        if field.shape == SHAPE_LIST:
+            return lambda value: [construct(_type, item) for item in value]
+        if field.shape in (SHAPE_DICT, SHAPE_MAPPING):
+            return lambda value: {
+                key: construct(_type, item) for key, item in value.items()
+            }
+    elif issubclass(_type, Enum) and field.shape == SHAPE_SINGLETON:
+        return _type
+
+
+# model => {field name: (field, converter)}, see construct
+_CONSTRUCT_PLANS: Dict[Type[BaseModel], Dict[str, Tuple]] = {}
+
+
+class ModelCache(Generic[M]):
+    """A TTL/LRU cache of parsed models keyed by their Redis key."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        """Counter bumped on every invalidation."""
+        return self._generation
+
+    def get(self, key: str) -> Optional[M]:
+        """
+        Return the cached model itself, shared by every reader: copy it
+        before changing it.
+        """
+        return self._cache.get(key)
+
+    def set(self, key: str, model: M, generation: int):
+        """Cache a model read before `generation` was taken."""
+        if generation != self._generation:
+            # invalidated while the model was being read
+            return
+        self._cache[key] = model
+
+    def invalidate(self, key: str):
+        self._generation += 1
+        self._cache.pop(key, None)
+
+    def clear(self):
+        self._generation += 1
+        self._cache.clear()
+
+
+class HashCodec(Generic[M]):
+    """
+    Map a model to a Redis hash with one hash field per model field.
+
+    Strings and string enums are stored as they are, every other field
+    is stored as JSON, and None fields are left out of the hash, so one
+    field can be written with a single HSET without touching the rest.
+    """
+
+    def __init__(self, model: Type[M], id_field: str):
+        self.model = model
+        self.id_field = id_field
+        self._raw: Dict[str, bool] = {}
+
+    def _is_raw(self, name: str) -> bool:
+        raw = self._raw.get(name)
+        if raw is None:
+            field = self.model.__fields__[name]
+            raw = (
+                field.shape == SHAPE_SINGLETON
+                and isinstance(field.type_, type)
+                and issubclass(field.type_, str)
+            )
+            self._raw[name] = raw
+        return raw
+
+    def encode_field(self, name: str, value: Any) -> str:
+        if self._is_raw(name):
+            return value.value if isinstance(value, Enum) else str(value)
+        return orjson.dumps(value, default=pydantic_encoder).decode()
+
+    def encode_fields(self, fields: Dict[str, Any]) -> Dict[str, str]:
+        """Encode the given fields, skipping the ones set to None."""
+        return {
+            name: self.encode_field(name, value)
+            for name, value in fields.items() if value is not None
+        }
+
+    def encode(self, model: M) -> Dict[str, str]:
+        return self.encode_fields({
+            name: getattr(model, name) for name in self.model.__fields__
+        })
+
+    def decode(self, mapping: Dict[str, str]) -> Optional[M]:
+        """
+        Parse a hash; a hash without its id field is a leftover of a
+        field update that raced a delete and is treated as missing.
+        """
+        if not mapping or not mapping.get(self.id_field):
+            return
+        data = {}
+        for name, value in mapping.items():
+            if name not in self.model.__fields__:
+                continue
+            data[name] = value if self._is_raw(name) else orjson.loads(value)
+        return construct(self.model, data)
+
+    def decode_values(
+            self, mapping: Dict[str, str], fields: Iterable[str]
+    ) -> Dict[str, Any]:
+        """
+        JSON-ready values of `fields` of a hash without building the
+        model, None for the ones not stored.
+        """
+        data = {}
+        for name in fields:
+            value = mapping.get(name)
+            if value is not None and not self._is_raw(name):
+                value = orjson.loads(value)
+            data[name] = value
+        return data
 
 
 @singleton
@@ -33,56 +232,293 @@ class DataManage:
     REDIS_PREFIX_SERVICE = 'service:'
     REDIS_PREFIX_ROBOT = 'robot:'
     REDIS_PREFIX_ROOM = 'room:'
+    REDIS_INDEX_SERVICE = 'index:service'
+    REDIS_INDEX_ROBOT = 'index:robot'
+    REDIS_INDEX_ROOM = 'index:room'
+    REDIS_INDEX_READY = 'index:ready'
+    REDIS_HASH_READY = 'layout:hash'
+    # {entity key: content digest, collection: random tag}, the ETags
+    REDIS_VERSIONS = 'versions'
+    VERSION_ROBOTS = 'robot'
+    # signaling state shared by the gateway workers
+    REDIS_WS_SESSIONS = 'ws:sessions'  # {sid: service_id}
+    REDIS_PREFIX_WS_ONLINE = 'ws:online:'  # sids connected to a service
+    REDIS_PREFIX_WS_ROOMS = 'ws:rooms:'  # rooms with live participants
+    REDIS_WS_REPLICAS = 'ws:replicas'
+    REDIS_PREFIX_WS_REPLICA = 'ws:replica:'  # sids of a gateway worker
+    REDIS_WS_HOMES = 'ws:homes'  # {service_id: replica_id}
+    REPLICA_TTL_S = 30
+    INDEX_CHUNK_SIZE = 500
+    REDIS_CHANNEL_INVALIDATE = 'teleop:invalidate'
+    RESUBSCRIBE_DELAY_S = 1
+    SERVICE_CODEC = HashCodec(ServiceModel, "service_id")
+    ROBOT_CODEC = HashCodec(RobotModel, "robot_id")
 
     @inject
     def __init__(self):
         self._redis: Optional[aioredis.Redis] = None
+        self._services: ModelCache[ServiceModel] = ModelCache(
+            self.CACHE_SIZE, self.CACHE_TTL
+        )
+        self._robots: ModelCache[RobotModel] = ModelCache(
+            self.CACHE_SIZE, self.CACHE_TTL
+        )
+        # service key => parsed rooms of the service, shared by callers
+        self._room_manages: TTLCache = TTLCache(
+            maxsize=self.CACHE_SIZE, ttl=self.CACHE_TTL
+        )
+        # tags the invalidations this process publishes, see invalidate
+        self._origin = "@" + uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+        self._invalidation_listeners: List[Callable[[str], None]] = []
 
     @property
     def redis(self) -> aioredis.Redis:
         """Return wrapped Redis instance."""
         return self._redis
 
-    async def create_redis(self, url: str):
-        """create the connection. Use at server startup."""
+    async def create_redis(
+            self, url: str, client: Optional[aioredis.Redis] = None
+    ):
+        """
+        create the connection. Use at server startup.
+        :param url: The Redis url.
+        :param client: Use this client instead of connecting to `url`,
+            e.g. a fakeredis client in tests. It must decode responses.
+        """
         if self.redis is not None:
-            await self.redis.close()
+            await self.close_redis()
         try:
-            self._redis = await aioredis.from_url(
+            self._redis = client or await aioredis.from_url(
                 url, encoding="utf-8", decode_responses=True
             )
         except: # noqa
             traceback.print_exc()
+            return
+        await self._build_index()
+        self._listener = asyncio.ensure_future(self._listen_invalidation())
 
     async def close_redis(self):
         """Close the connection. Use at server shutdown."""
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
         await self.redis.close()
 
+    def add_invalidation_listener(self, func: Callable[[str], None]):
+        """
+        Call `func` with every key changed here or on another replica.
+        It runs in the listener task and must not block.
+        """
+        self._invalidation_listeners.append(func)
+
+    def _drop_cache(self, key: str):
+        if key.startswith(self.REDIS_PREFIX_SERVICE):
+            self._services.invalidate(key)
+            self._room_manages.pop(key, None)
+        elif key.startswith(self.REDIS_PREFIX_ROBOT):
+            self._robots.invalidate(key)
+        for func in self._invalidation_listeners:
+            try:
+                func(key)
+            except Exception:  # noqa
+                traceback.print_exc()
+
+    async def invalidate(self, *keys: str):
+        """
+        Drop cached keys here and on every other replica. The message
+        starts with the origin of this process, so that the listener
+        skips the ones it published itself.
+        """
+        if not keys:
+            return
+        for key in keys:
+            self._drop_cache(key)
+        await self.redis.publish(
+            self.REDIS_CHANNEL_INVALIDATE, " ".join((self._origin,) + keys)
+        )
+
+    async def _listen_invalidation(self):
+        while 1:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.REDIS_CHANNEL_INVALIDATE)
+                # anything published while we were not subscribed is lost
+                self._services.clear()
+                self._robots.clear()
+                self._room_manages.clear()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    keys = (message.get("data") or "").split()
+                    if keys and keys[0].startswith("@"):
+                        if keys[0] == self._origin:
+                            continue  # dropped when it was published
+                        keys = keys[1:]
+                    for key in keys:
+                        self._drop_cache(key)
+            except asyncio.CancelledError:
+                await pubsub.close()
+                raise
+            except Exception:  # noqa
+                traceback.print_exc()
+            await pubsub.close()
+            await asyncio.sleep(self.RESUBSCRIBE_DELAY_S)
+
+    @timed_redis("get_string")
     async def get_string(self, key: str, default=None):
         """get a string value in Redis."""
         return (await self.redis.get(key)) or default
 
+    @timed_redis("set_string")
     async def set_string(self, key: str, value: str):
         """Set a string value in Redis."""
         await self.redis.set(key, value)
 
     async def get_service(self, service_id: str) -> Optional[ServiceModel]:
-        """Get a service from Redis."""
-        data: str = await self.get_string(
-            self.REDIS_PREFIX_SERVICE + service_id
+        """
+        Get a service from the cache or Redis. The model is shared with
+        the other readers, copy it before changing it.
+        """
+        return await self._get_entity(
+            self.REDIS_PREFIX_SERVICE + service_id,
+            self.SERVICE_CODEC, self._services
         )
-        if data is None:
-            return
-        return ServiceModel.parse_raw(data)
+
+    @timed_redis("get_service_token")
+    async def get_service_token(self, service_id: str) -> Optional[str]:
+        """
+        Get the token of a service without reading the whole service;
+        None if there is no such service.
+        """
+        key = self.REDIS_PREFIX_SERVICE + service_id
+        service = self._services.get(key)
+        if service is None:
+            try:
+                found, token = await self.redis.hmget(
+                    key, ["service_id", "token"]
+                )
+            except ResponseError as err:
+                if not self._is_wrong_type(err):
+                    raise
+                service = await self.get_service(service_id)
+            else:
+                return None if found is None else token or ""
+        return None if service is None else service.token or ""
 
     async def get_robot(self, robot_id: str) -> Optional[RobotModel]:
-        """Get a robot from Redis."""
-        data: str = await self.get_string(
-            self.REDIS_PREFIX_ROBOT + robot_id
+        """Get a shared robot from the cache or Redis, as get_service."""
+        return await self._get_entity(
+            self.REDIS_PREFIX_ROBOT + robot_id,
+            self.ROBOT_CODEC, self._robots
         )
-        if data is None:
+
+    @timed_redis("get_robots")
+    async def get_robots(
+            self, robot_ids: Iterable[str]
+    ) -> Dict[str, RobotModel]:
+        """
+        Get shared robots by id in one round trip, skipping unknown ids.
+        """
+        robots: Dict[str, RobotModel] = {}
+        missing = []
+        for robot_id in robot_ids:
+            robot = self._robots.get(self.REDIS_PREFIX_ROBOT + robot_id)
+            if robot is None:
+                missing.append(robot_id)
+            else:
+                robots[robot_id] = robot
+        if not missing:
+            return robots
+        generation = self._robots.generation
+        keys = [self.REDIS_PREFIX_ROBOT + robot_id for robot_id in missing]
+        for key, robot_id, robot in zip(
+                keys, missing, await self._get_hashes(keys, self.ROBOT_CODEC)
+        ):
+            if robot is None:
+                continue
+            self._robots.set(key, robot, generation)
+            robots[robot_id] = robot
+        return robots
+
+    @timed_redis("get_room_manage")
+    async def get_room_manage(self, service_id: str) -> Optional[RoomManage]:
+        """
+        Get the parsed rooms of a service, reading only its rooms field.
+        The instance is shared and for reading only: change the rooms
+        with `modify_room_manage`.
+        """
+        key = self.REDIS_PREFIX_SERVICE + service_id
+        rooms = self._room_manages.get(key)
+        if rooms is not None:
+            return rooms
+        generation = self._services.generation
+        try:
+            _id, raw = await self.redis.hmget(
+                key, self.SERVICE_CODEC.id_field, "rooms"
+            )
+        except ResponseError as e:
+            if not self._is_wrong_type(e):
+                raise
+            mapping = await self._migrate_key(key, self.SERVICE_CODEC)
+            _id, raw = mapping.get("service_id"), mapping.get("rooms")
+        if not _id:
             return
-        return RobotModel.parse_raw(data)
+        rooms = RoomManage(service_id)
+        if raw is None:
+            rooms.initial()
+        else:
+            rooms.update_from_json(orjson.loads(raw))
+        if generation == self._services.generation:
+            self._room_manages[key] = rooms
+        return rooms
+
+    @timed_redis("modify_room_manage")
+    async def modify_room_manage(
+            self, service_id: str, func: Callable[[RoomManage], Any]
+    ) -> Tuple[Optional[RoomManage], Any]:
+        """
+        Apply `func` to a private copy of the rooms of a service and save
+        them, leaving its other fields as is and retrying when the
+        service changed meanwhile. Returns the saved rooms and what
+        `func` returned, (None, None) when there is no such service.
+        """
+        key = self.REDIS_PREFIX_SERVICE + service_id
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while 1:
+                try:
+                    await pipe.watch(key)
+                    try:
+                        _id, raw = await pipe.hmget(
+                            key, self.SERVICE_CODEC.id_field, "rooms"
+                        )
+                    except ResponseError as e:
+                        if not self._is_wrong_type(e):
+                            raise
+                        await self._migrate_key(key, self.SERVICE_CODEC)
+                        continue
+                    if not _id:
+                        return None, None
+                    rooms = RoomManage(service_id)
+                    if raw is None:
+                        rooms.initial()
+                    else:
+                        rooms.update_from_json(orjson.loads(raw))
+                    result = func(rooms)
+                    pipe.multi()
+                    pipe.hset(key, "rooms", self.SERVICE_CODEC.encode_field(
+                        "rooms", rooms.json()
+                    ))
+                    pipe.hset(self.REDIS_VERSIONS, mapping=self._new_versions(
+                        {key: uuid.uuid4().hex}
+                    ))
+                    await pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        await self.invalidate(key)
+        self._room_manages[key] = rooms
+        return rooms, result
 
     async def get_room(self, room_id: str) -> Optional[RoomModel]:
         """Get a room from Redis."""
@@ -91,67 +527,706 @@ class DataManage:
         )
         if data is None:
             return
-        return RoomModel.parse_raw(data)
+        return construct(RoomModel, orjson.loads(data))
 
     async def update_service(self, service_id: str, data: ServiceModel):
         """Update a service in Redis."""
-        await self.set_string(
-            self.REDIS_PREFIX_SERVICE + service_id, data.json()
+        key = self.REDIS_PREFIX_SERVICE + service_id
+        await self._set_entity(
+            key, self.REDIS_INDEX_SERVICE, service_id,
+            self.SERVICE_CODEC.encode(data)
         )
+        await self.invalidate(key)
 
     async def update_robot(self, robot_id: str, data: RobotModel):
         """Update a robot in Redis."""
-        await self.set_string(
-            self.REDIS_PREFIX_ROBOT + robot_id, data.json()
+        key = self.REDIS_PREFIX_ROBOT + robot_id
+        await self._set_entity(
+            key, self.REDIS_INDEX_ROBOT, robot_id,
+            self.ROBOT_CODEC.encode(data)
         )
+        await self.invalidate(key)
 
     async def update_room(self, room_id: str, data: RoomModel):
         """Update a room in Redis."""
-        await self.set_string(
-            self.REDIS_PREFIX_ROOM + room_id, data.json()
+        await self._set_entity(
+            self.REDIS_PREFIX_ROOM + room_id,
+            self.REDIS_INDEX_ROOM, room_id, data.json()
+        )
+
+    @timed_redis("update_service_fields")
+    async def update_service_fields(self, service_id: str, **fields):
+        """
+        Update some fields of a service without rewriting the others,
+        e.g. `update_service_fields(service_id, status=ServerStatus.active)`
+        """
+        await self._update_fields(
+            self.REDIS_PREFIX_SERVICE + service_id, self.SERVICE_CODEC, fields
         )
 
+    @timed_redis("update_robot_fields")
+    async def update_robot_fields(self, robot_id: str, **fields):
+        """Update some fields of a robot without rewriting the others."""
+        await self._update_fields(
+            self.REDIS_PREFIX_ROBOT + robot_id, self.ROBOT_CODEC, fields
+        )
+
+    @timed_redis("update_robots")
+    async def update_robots(self, robots: Iterable[RobotModel]):
+        """
+        Update robots in Redis in one round trip, skipping the robots
+        whose stored content is the same.
+        """
+        values = {
+            self.REDIS_PREFIX_ROBOT + robot.robot_id:
+                self.ROBOT_CODEC.encode(robot)
+            for robot in robots
+        }
+        if not values:
+            return
+        digests = {key: _digest(mapping) for key, mapping in values.items()}
+        stored = await self.redis.hmget(self.REDIS_VERSIONS, list(values))
+        for key, version in zip(list(values), stored):
+            if version == digests[key]:
+                del values[key]
+                del digests[key]
+        if not values:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key, mapping in values.items():
+                pipe.delete(key)
+                pipe.hset(key, mapping=mapping)
+            pipe.zadd(self.REDIS_INDEX_ROBOT, {
+                key[len(self.REDIS_PREFIX_ROBOT):]: 0 for key in values
+            })
+            pipe.hset(
+                self.REDIS_VERSIONS, mapping=self._new_versions(digests)
+            )
+            await pipe.execute()
+        await self.invalidate(*values)
+
+    @timed_redis("delete_service")
     async def delete_service(self, service_id: str):
-        """Delete a service in Redis."""
-        await self.redis.delete(self.REDIS_PREFIX_SERVICE + service_id)
+        """Delete a service and its signaling state in Redis."""
+        key = self.REDIS_PREFIX_SERVICE + service_id
+        await self._delete_entity(key, self.REDIS_INDEX_SERVICE, service_id)
+        await self.redis.delete(
+            self.REDIS_PREFIX_WS_ROOMS + service_id,
+            self.REDIS_PREFIX_WS_ONLINE + service_id,
+        )
+        await self.redis.hdel(self.REDIS_WS_HOMES, service_id)
+        await self.invalidate(key)
 
+    @timed_redis("delete_robot")
     async def delete_robot(self, robot_id: str):
         """Delete a robot in Redis."""
-        await self.redis.delete(self.REDIS_PREFIX_ROBOT + robot_id)
+        key = self.REDIS_PREFIX_ROBOT + robot_id
+        await self._delete_entity(key, self.REDIS_INDEX_ROBOT, robot_id)
+        await self.invalidate(key)
 
+    @timed_redis("delete_room")
     async def delete_room(self, room_id: str):
         """Delete a room in Redis."""
-        await self.redis.delete(self.REDIS_PREFIX_ROOM + room_id)
+        await self._delete_entity(
+            self.REDIS_PREFIX_ROOM + room_id, self.REDIS_INDEX_ROOM, room_id
+        )
 
+    @timed_redis("delete_robots")
+    async def delete_robots(self, robot_ids: Iterable[str]):
+        """Delete robots in Redis in one round trip."""
+        robot_ids = list(robot_ids)
+        if not robot_ids:
+            return
+        keys = [self.REDIS_PREFIX_ROBOT + robot_id for robot_id in robot_ids]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*keys)
+            pipe.zrem(self.REDIS_INDEX_ROBOT, *robot_ids)
+            pipe.hdel(self.REDIS_VERSIONS, *keys)
+            pipe.hset(
+                self.REDIS_VERSIONS, mapping=self._new_versions({}, *keys)
+            )
+            await pipe.execute()
+        await self.invalidate(*keys)
+
+    async def get_robot_ids(self) -> List[str]:
+        """Get the id of every robot from the index."""
+        robot_ids = []
+        async for ids in self._iter_index(self.REDIS_INDEX_ROBOT):
+            robot_ids.extend(ids)
+        return robot_ids
+
+    @timed_redis("get_all_services")
     async def get_all_services(self) -> List[ServiceModel]:
         """Get all services from Redis."""
-        keys = await self.redis.keys(self.REDIS_PREFIX_SERVICE + '*')
-        services = []
-        for data in await self.redis.mget(keys):
-            try:
-                services.append(ServiceModel.parse_raw(data))
-            except:  # noqa
-                pass
-        return services
+        return await self._get_all(
+            self.REDIS_PREFIX_SERVICE, self.REDIS_INDEX_SERVICE,
+            ServiceModel, self.SERVICE_CODEC
+        )
 
+    @timed_redis("get_all_robots")
     async def get_all_robots(self) -> List[RobotModel]:
         """Get all robots from Redis."""
-        keys = await self.redis.keys(self.REDIS_PREFIX_ROBOT + '*')
-        robots = []
-        for data in await self.redis.mget(keys):
-            try:
-                robots.append(RobotModel.parse_raw(data))
-            except:  # noqa
-                pass
-        return robots
+        return await self._get_all(
+            self.REDIS_PREFIX_ROBOT, self.REDIS_INDEX_ROBOT,
+            RobotModel, self.ROBOT_CODEC
+        )
 
+    @timed_redis("get_all_rooms")
     async def get_all_rooms(self) -> List[RoomModel]:
         """Get all rooms from Redis."""
-        keys = await self.redis.keys(self.REDIS_PREFIX_ROOM + '*')
-        rooms = []
-        for data in await self.redis.mget(keys):
+        return await self._get_all(
+            self.REDIS_PREFIX_ROOM, self.REDIS_INDEX_ROOM, RoomModel
+        )
+
+    @timed_redis("get_service_rows")
+    async def get_service_rows(
+            self, fields: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get `fields` (default all) of every service as plain dicts,
+        read straight from the hashes without building models.
+        """
+        return await self._get_rows(
+            self.REDIS_PREFIX_SERVICE, self.REDIS_INDEX_SERVICE,
+            self.SERVICE_CODEC, fields
+        )
+
+    @timed_redis("get_robot_rows")
+    async def get_robot_rows(
+            self, fields: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Get `fields` (default all) of every robot as plain dicts."""
+        return await self._get_rows(
+            self.REDIS_PREFIX_ROBOT, self.REDIS_INDEX_ROBOT,
+            self.ROBOT_CODEC, fields
+        )
+
+    @timed_redis("get_service_page")
+    async def get_service_page(
+            self, fields: Optional[List[str]] = None,
+            after: str = "", limit: int = 100
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Get `fields` of at most `limit` services with ids after `after`,
+        in id order, and the id to continue after; None on the last page.
+        """
+        return await self._get_page(
+            self.REDIS_PREFIX_SERVICE, self.REDIS_INDEX_SERVICE,
+            self.SERVICE_CODEC, fields, after, limit
+        )
+
+    @timed_redis("get_robot_page")
+    async def get_robot_page(
+            self, fields: Optional[List[str]] = None,
+            after: str = "", limit: int = 100
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get a page of robots in id order, as get_service_page."""
+        return await self._get_page(
+            self.REDIS_PREFIX_ROBOT, self.REDIS_INDEX_ROBOT,
+            self.ROBOT_CODEC, fields, after, limit
+        )
+
+    @timed_redis("read_service_rows")
+    async def read_service_rows(
+            self, service_ids: List[str], fields: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get `fields` of the services of `service_ids` as plain dicts,
+        leaving out the services that do not exist.
+        """
+        return await self._read_rows(
+            self.REDIS_PREFIX_SERVICE, self.REDIS_INDEX_SERVICE,
+            self.SERVICE_CODEC, service_ids, fields
+        )
+
+    @timed_redis("read_robot_rows")
+    async def read_robot_rows(
+            self, robot_ids: List[str], fields: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Get `fields` of some robots, as read_service_rows."""
+        return await self._read_rows(
+            self.REDIS_PREFIX_ROBOT, self.REDIS_INDEX_ROBOT,
+            self.ROBOT_CODEC, robot_ids, fields
+        )
+
+    async def count_services(self) -> int:
+        return await self.redis.zcard(self.REDIS_INDEX_SERVICE)
+
+    async def count_robots(self) -> int:
+        return await self.redis.zcard(self.REDIS_INDEX_ROBOT)
+
+    async def get_version(self, key: str) -> Optional[str]:
+        """
+        The version tag of a service or robot key, None when it has
+        not been written since versions were kept.
+        """
+        return await self.redis.hget(self.REDIS_VERSIONS, key)
+
+    async def get_robots_version(self) -> str:
+        """The version tag of the robot list."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hsetnx(
+                self.REDIS_VERSIONS, self.VERSION_ROBOTS, uuid.uuid4().hex
+            )
+            pipe.hget(self.REDIS_VERSIONS, self.VERSION_ROBOTS)
+            _, version = await pipe.execute()
+        return version
+
+    async def register_replica(self, replica_id: str, url: str = ""):
+        """
+        Announce a gateway worker and the url clients reach it at;
+        call at least every REPLICA_TTL_S.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(
+                self.REDIS_PREFIX_WS_REPLICA + replica_id + ":alive", url,
+                ex=self.REPLICA_TTL_S
+            )
+            pipe.sadd(self.REDIS_WS_REPLICAS, replica_id)
+            await pipe.execute()
+
+    async def get_replicas(self) -> Dict[str, str]:
+        """Get the url of every live gateway worker by replica id."""
+        replicas = sorted(await self.redis.smembers(self.REDIS_WS_REPLICAS))
+        if not replicas:
+            return {}
+        urls = await self.redis.mget([
+            self.REDIS_PREFIX_WS_REPLICA + replica_id + ":alive"
+            for replica_id in replicas
+        ])
+        return {
+            replica_id: url
+            for replica_id, url in zip(replicas, urls)
+            if url is not None
+        }
+
+    async def get_home(self, service_id: str) -> Optional[str]:
+        """Get the gateway worker the sessions of a service are kept on."""
+        return await self.redis.hget(self.REDIS_WS_HOMES, service_id)
+
+    async def set_home(self, service_id: str, replica_id: str,
+                       force: bool = False) -> str:
+        """
+        Make `replica_id` the home of a service unless it already has
+        one, or always with `force`. Returns the home of the service.
+        """
+        if force:
+            await self.redis.hset(self.REDIS_WS_HOMES, service_id, replica_id)
+            return replica_id
+        if await self.redis.hsetnx(self.REDIS_WS_HOMES, service_id,
+                                   replica_id):
+            return replica_id
+        return await self.get_home(service_id) or replica_id
+
+    async def clear_home(self, service_id: str, replica_id: str = ""):
+        """Forget the home of a service, if it is `replica_id` when given."""
+        if replica_id and await self.get_home(service_id) != replica_id:
+            return
+        await self.redis.hdel(self.REDIS_WS_HOMES, service_id)
+
+    @timed_redis("add_session")
+    async def add_session(self, sid: str, service_id: str, replica_id: str):
+        """Record a socket.io session of a service on a gateway worker."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.REDIS_WS_SESSIONS, sid, service_id)
+            pipe.sadd(self.REDIS_PREFIX_WS_ONLINE + service_id, sid)
+            pipe.sadd(self.REDIS_PREFIX_WS_REPLICA + replica_id, sid)
+            await pipe.execute()
+
+    @timed_redis("remove_session")
+    async def remove_session(
+            self, sid: str, replica_id: str
+    ) -> Optional[str]:
+        """Forget a socket.io session, return the service it was in."""
+        service_id = await self.redis.hget(self.REDIS_WS_SESSIONS, sid)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self.REDIS_WS_SESSIONS, sid)
+            if service_id:
+                pipe.srem(self.REDIS_PREFIX_WS_ONLINE + service_id, sid)
+            pipe.srem(self.REDIS_PREFIX_WS_REPLICA + replica_id, sid)
+            await pipe.execute()
+        return service_id
+
+    async def get_session(self, sid: str) -> Optional[str]:
+        """Get the service of a session on any gateway worker."""
+        return await self.redis.hget(self.REDIS_WS_SESSIONS, sid)
+
+    async def get_online(self, service_id: str) -> Set[str]:
+        """Get the sids connected to a service on any gateway worker."""
+        return await self.redis.smembers(
+            self.REDIS_PREFIX_WS_ONLINE + service_id
+        )
+
+    async def count_online(self, service_id: str) -> int:
+        return await self.redis.scard(
+            self.REDIS_PREFIX_WS_ONLINE + service_id
+        )
+
+    async def reap_replicas(self) -> Dict[str, List[str]]:
+        """
+        Drop the sessions of gateway workers that stopped announcing
+        themselves. Returns the dropped sids by service.
+        """
+        dropped: Dict[str, List[str]] = {}
+        for replica_id in await self.redis.smembers(self.REDIS_WS_REPLICAS):
+            key = self.REDIS_PREFIX_WS_REPLICA + replica_id
+            if await self.redis.exists(key + ":alive"):
+                continue
+            sids = list(await self.redis.smembers(key))
+            services = await self.redis.hmget(
+                self.REDIS_WS_SESSIONS, sids
+            ) if sids else []
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for sid, service_id in zip(sids, services):
+                    if service_id:
+                        pipe.srem(
+                            self.REDIS_PREFIX_WS_ONLINE + service_id, sid
+                        )
+                        dropped.setdefault(service_id, []).append(sid)
+                if sids:
+                    pipe.hdel(self.REDIS_WS_SESSIONS, *sids)
+                pipe.delete(key)
+                pipe.srem(self.REDIS_WS_REPLICAS, replica_id)
+                await pipe.execute()
+        return dropped
+
+    @timed_redis("get_ws_rooms")
+    async def get_ws_rooms(self, service_id: str) -> Optional[RoomManage]:
+        """Get the rooms of a service with their live participants."""
+        raw = await self.redis.get(self.REDIS_PREFIX_WS_ROOMS + service_id)
+        if raw is None:
+            return
+        rooms = RoomManage(service_id)
+        rooms.update_from_json(orjson.loads(raw))
+        return rooms
+
+    @timed_redis("modify_ws_rooms")
+    async def modify_ws_rooms(
+            self, service_id: str, func: Callable[[RoomManage], Any]
+    ) -> Tuple[RoomManage, Any]:
+        """
+        Apply `func` to the live rooms of a service and save them,
+        retrying when another worker changed them meanwhile. The rooms
+        start as a copy of the stored rooms of the service. Returns the
+        saved rooms and what `func` returned.
+        """
+        key = self.REDIS_PREFIX_WS_ROOMS + service_id
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while 1:
+                try:
+                    await pipe.watch(key)
+                    raw = await pipe.get(key)
+                    if raw is None:
+                        rooms = await self.get_room_manage(service_id)
+                        rooms = (
+                            rooms.copy() if rooms is not None
+                            else RoomManage(service_id)
+                        )
+                    else:
+                        rooms = RoomManage(service_id)
+                        rooms.update_from_json(orjson.loads(raw))
+                    result = func(rooms)
+                    pipe.multi()
+                    pipe.set(key, orjson.dumps(rooms.json()))
+                    await pipe.execute()
+                    return rooms, result
+                except WatchError:
+                    continue
+
+    @timed_redis("get_entity")
+    async def _get_entity(
+            self, key: str, codec: HashCodec[M], cache: ModelCache[M]
+    ) -> Optional[M]:
+        model = cache.get(key)
+        if model is not None:
+            return model
+        generation = cache.generation
+        try:
+            mapping = await self.redis.hgetall(key)
+        except ResponseError as e:
+            if not self._is_wrong_type(e):
+                raise
+            # still stored as a JSON string by an older release
+            mapping = await self._migrate_key(key, codec)
+        model = codec.decode(mapping)
+        if model is None:
+            if mapping:
+                await self.redis.delete(key)
+            return
+        cache.set(key, model, generation)
+        return model
+
+    async def _get_hashes(
+            self, keys: List[str], codec: HashCodec[M]
+    ) -> List[Optional[M]]:
+        """Read and parse many hashes in one round trip."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            mappings = await pipe.execute(raise_on_error=False)
+        models = []
+        for key, mapping in zip(keys, mappings):
+            if self._is_wrong_type(mapping):
+                mapping = await self._migrate_key(key, codec)
             try:
-                rooms.append(RoomModel.parse_raw(data))
+                models.append(codec.decode(mapping))
             except:  # noqa
+                models.append(None)
+        return models
+
+    async def _update_fields(
+            self, key: str, codec: HashCodec, fields: Dict[str, Any]
+    ):
+        mapping = codec.encode_fields(fields)
+        removed = [name for name, value in fields.items() if value is None]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if mapping:
+                pipe.hset(key, mapping=mapping)
+            if removed:
+                pipe.hdel(key, *removed)
+            # no digest without reading the other fields back
+            pipe.hset(self.REDIS_VERSIONS, mapping=self._new_versions(
+                {key: uuid.uuid4().hex}
+            ))
+            results = await pipe.execute(raise_on_error=False)
+        for result in results:
+            if not isinstance(result, ResponseError):
+                continue
+            if not self._is_wrong_type(result):
+                raise result
+            if await self._migrate_key(key, codec):
+                await self._update_fields(key, codec, fields)
+                return
+            break
+        await self.invalidate(key)
+
+    @staticmethod
+    def _is_wrong_type(error) -> bool:
+        return (
+            isinstance(error, ResponseError)
+            and str(error).startswith("WRONGTYPE")
+        )
+
+    async def _migrate_key(self, key: str, codec: HashCodec) -> Dict:
+        """Rewrite a model stored as a JSON string as a hash."""
+        data = await self.redis.get(key)
+        if data is None:
+            return {}
+        mapping = codec.encode(codec.model.parse_raw(data))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            await pipe.execute()
+        self._drop_cache(key)
+        return mapping
+
+    @timed_redis("set_entity")
+    async def _set_entity(
+            self, key: str, index: str, _id: str,
+            value: Union[str, Dict[str, str]]
+    ):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if isinstance(value, dict):
+                # replace the hash so that fields now None are dropped
+                pipe.delete(key)
+                pipe.hset(key, mapping=value)
+                pipe.hset(self.REDIS_VERSIONS, mapping=self._new_versions(
+                    {key: _digest(value)}
+                ))
+            else:
+                pipe.set(key, value)
+            pipe.zadd(index, {_id: 0})
+            await pipe.execute()
+
+    @timed_redis("delete_entity")
+    async def _delete_entity(self, key: str, index: str, _id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.zrem(index, _id)
+            pipe.hdel(self.REDIS_VERSIONS, key)
+            pipe.hset(self.REDIS_VERSIONS, mapping=self._new_versions({}, key))
+            await pipe.execute()
+
+    @staticmethod
+    def _new_versions(
+            versions: Dict[str, str], *keys: str
+    ) -> Dict[str, str]:
+        """
+        Add a fresh tag for the collection of every key in `versions`
+        and `keys`, e.g. `robot` for `robot:<robot_id>`.
+        """
+        tag = uuid.uuid4().hex
+        versions = dict(versions)
+        for key in list(versions) + list(keys):
+            versions[key.split(":", 1)[0]] = tag
+        return versions
+
+    async def _iter_index(self, index: str) -> AsyncIterator[List[str]]:
+        """Yield the ids of an index in chunks, in lexical order."""
+        start = "-"
+        while 1:
+            ids = await self.redis.zrangebylex(
+                index, start, "+", start=0, num=self.INDEX_CHUNK_SIZE
+            )
+            if not ids:
+                return
+            yield ids
+            if len(ids) < self.INDEX_CHUNK_SIZE:
+                return
+            start = "(" + ids[-1]
+
+    async def _get_all(
+            self, prefix: str, index: str, model: Type[M],
+            codec: Optional[HashCodec[M]] = None
+    ) -> List[M]:
+        items = []
+        async for ids in self._iter_index(index):
+            keys = [prefix + _id for _id in ids]
+            if codec is not None:
+                values = await self._get_hashes(keys, codec)
+            else:
+                values = []
+                for data in await self.redis.mget(keys):
+                    try:
+                        values.append(
+                            data and construct(model, orjson.loads(data))
+                        )
+                    except:  # noqa
+                        values.append(None)
+            missing = []
+            for _id, item in zip(ids, values):
+                if item is None:
+                    missing.append(_id)
+                    continue
+                items.append(item)
+            if missing:
+                await self._prune_index(prefix, index, missing)
+        return items
+
+    async def _get_rows(
+            self, prefix: str, index: str, codec: HashCodec,
+            fields: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        rows = []
+        async for ids in self._iter_index(index):
+            rows.extend(
+                await self._read_rows(prefix, index, codec, ids, fields)
+            )
+        return rows
+
+    async def _get_page(
+            self, prefix: str, index: str, codec: HashCodec,
+            fields: Optional[List[str]] = None,
+            after: str = "", limit: int = 100
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # one id more tells whether there is a next page
+        ids = await self.redis.zrangebylex(
+            index, "(" + after if after else "-", "+",
+            start=0, num=limit + 1
+        )
+        more = len(ids) > limit
+        ids = ids[:limit]
+        rows = await self._read_rows(prefix, index, codec, ids, fields)
+        return rows, (ids[-1] if more else None)
+
+    async def _read_rows(
+            self, prefix: str, index: str, codec: HashCodec,
+            ids: List[str], fields: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Read `fields` of the hashes of `ids` in one round trip."""
+        if not ids:
+            return []
+        fields = list(fields or codec.model.__fields__)
+        # the id field tells a live hash from a leftover
+        names = [codec.id_field] + [
+            name for name in fields if name != codec.id_field
+        ]
+        keys = [prefix + _id for _id in ids]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hmget(key, names)
+            values = await pipe.execute(raise_on_error=False)
+        rows = []
+        missing = []
+        for _id, key, value in zip(ids, keys, values):
+            if self._is_wrong_type(value):
+                value = await self._migrate_key(key, codec)
+                value = [value.get(name) for name in names]
+            elif isinstance(value, Exception):
+                raise value
+            if not value[0]:
+                missing.append(_id)
+                continue
+            rows.append(codec.decode_values(dict(zip(names, value)), fields))
+        if missing:
+            await self._prune_index(prefix, index, missing)
+        return rows
+
+    async def _prune_index(self, prefix: str, index: str, ids: List[str]):
+        """
+        Drop the ids whose entity expired or was removed behind our back
+        from an index. Their keys are watched, so an entity written or
+        recreated meanwhile keeps its entry.
+        """
+        keys = [prefix + _id for _id in ids]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(*keys)
+                gone = [
+                    _id for _id, key in zip(ids, keys)
+                    if not await pipe.exists(key)
+                ]
+                if not gone:
+                    return
+                pipe.multi()
+                pipe.zrem(index, *gone)
+                await pipe.execute()
+            except WatchError:
+                # written meanwhile, the next read checks again
                 pass
-        return rooms
+
+    async def _build_index(self):
+        """Index the entities written before index sets were maintained."""
+        if not await self.redis.exists(self.REDIS_INDEX_READY):
+            for prefix, index in (
+                    (self.REDIS_PREFIX_SERVICE, self.REDIS_INDEX_SERVICE),
+                    (self.REDIS_PREFIX_ROBOT, self.REDIS_INDEX_ROBOT),
+                    (self.REDIS_PREFIX_ROOM, self.REDIS_INDEX_ROOM),
+            ):
+                ids = []
+                async for key in self.redis.scan_iter(
+                        match=prefix + "*", count=self.INDEX_CHUNK_SIZE
+                ):
+                    ids.append(key[len(prefix):])
+                    if len(ids) >= self.INDEX_CHUNK_SIZE:
+                        await self.redis.zadd(index, dict.fromkeys(ids, 0))
+                        ids = []
+                if ids:
+                    await self.redis.zadd(index, dict.fromkeys(ids, 0))
+            await self.redis.set(self.REDIS_INDEX_READY, 1)
+        await self._migrate_hashes()
+
+    async def _migrate_hashes(self):
+        """Convert services and robots stored as JSON strings to hashes."""
+        if await self.redis.exists(self.REDIS_HASH_READY):
+            return
+        for prefix, index, codec in (
+                (self.REDIS_PREFIX_SERVICE, self.REDIS_INDEX_SERVICE,
+                 self.SERVICE_CODEC),
+                (self.REDIS_PREFIX_ROBOT, self.REDIS_INDEX_ROBOT,
+                 self.ROBOT_CODEC),
+        ):
+            async for ids in self._iter_index(index):
+                keys = [prefix + _id for _id in ids]
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.type(key)
+                    types = await pipe.execute()
+                for key, _type in zip(keys, types):
+                    if _type != "string":
+                        continue
+                    try:
+                        await self._migrate_key(key, codec)
+                    except:  # noqa
+                        traceback.print_exc()
+        await self.redis.set(self.REDIS_HASH_READY, 1)
@@ -18,6 +18,7 @@ from typing import Optional
 from typing import Dict
 from typing import List
 from typing import Any
+from typing import Set
 
 from pydantic import BaseModel
 from pydantic.fields import ModelField
@@ -216,17 +217,32 @@ class RoomManage:
         self.service_id = service_id
         self.rooms: Dict[str, RoomModel] = {}  # {room_name: RoomModel}
         self.base_num = base_num
+        # {client_id: {room_name: RoomClient}}
         self.participants: Dict[str, Dict] = {}
+        # indexes of self.rooms, {room_id / room_alias: {room_name: None}}
+        # in registration order, so the first room registered wins
+        self._by_id: Dict[Any, Dict[str, None]] = {}
+        self._by_alias: Dict[Any, Dict[str, None]] = {}
+        # {room_name: {client_name: RoomClient}}
+        self._members: Dict[str, Dict[str, RoomClient]] = {}
+        # {id(room): room_name}, a room may be kept under a name other
+        # than its own room_name
+        self._names: Dict[int, str] = {}
+        # rooms whose participants_list lags behind self._members
+        self._dirty: Set[str] = set()
+        self.active_rooms = 0  # rooms with at least one participant
+        self.participant_total = 0  # participants summed over rooms
 
     @property
     def participant_number(self):
         return len(self.participants)
 
     def json(self) -> Dict:
+        self._sync()
         return {
             "service_id": self.service_id,
             "rooms": {
-                room_name: room.json()
+                room_name: room.dict()
                 for room_name, room in self.rooms.items()
             },
             "base_num": self.base_num
@@ -242,11 +258,23 @@ class RoomManage:
             self.service_id = raw.get("service_id")
         if isinstance(raw.get("rooms"), Dict):
             for room_name, room in raw.get("rooms").items():
-                self.rooms[room_name] = RoomModel.parse_raw(room)
+                if isinstance(room, str):
+                    # rooms were stored as nested JSON strings before
+                    self._add_room(room_name, RoomModel.parse_raw(room))
+                else:
+                    self._add_room(room_name, RoomModel.parse_obj(room))
         base_num = raw.get("base_num") or self.base_num
         if str(base_num).isdigit():
             self.base_num = int(base_num)
 
+    def copy(self) -> "RoomManage":
+        """Copy the rooms, leaving out the clients tracked by this one."""
+        self._sync()
+        rooms = RoomManage(self.service_id, base_num=self.base_num)
+        for room_name, room in self.rooms.items():
+            rooms._add_room(room_name, room.copy(deep=True))
+        return rooms
+
     def update_base_num(self, base_num: int):
         self.base_num = base_num
 
@@ -262,7 +290,7 @@ class RoomManage:
             ["other", "Other", "text"],
         ]
         for inx, item in enumerate(raw):
-            self.rooms[item[0]] = RoomModel(
+            self._add_room(item[0], RoomModel(
                 room_id=self.base_num + inx,
                 room_name=item[0],
                 room_alias=item[1],
@@ -271,9 +299,76 @@ class RoomManage:
                 max_users=self.max_users,
                 participants=0,
                 participants_list=[],
-            )
+            ))
         self.base_num += len(raw)
 
+    def _add_room(self, room_name: str, room: RoomModel):
+        if room_name in self.rooms:
+            self._remove_room(room_name)
+        self.rooms[room_name] = room
+        self._names[id(room)] = room_name
+        self._by_id.setdefault(room.room_id, {})[room_name] = None
+        self._by_alias.setdefault(room.room_alias, {})[room_name] = None
+        members = {}
+        for client in room.participants_list or []:
+            if not isinstance(client, RoomClient):
+                client = RoomClient.parse_obj(client)
+            members[client.client_name] = client
+            self.participants.setdefault(
+                client.client_id, {}
+            )[room_name] = client
+        self._members[room_name] = members
+        room.participants_list = list(members.values())
+        room.participants = 0  # not counted in the totals yet
+        self._set_participants(room, len(members))
+
+    def _remove_room(self, room_name: str) -> Optional[RoomModel]:
+        room = self.rooms.pop(room_name, None)
+        if room is None:
+            return
+        self._names.pop(id(room), None)
+        for index, key in ((self._by_id, room.room_id),
+                           (self._by_alias, room.room_alias)):
+            names = index.get(key, {})
+            names.pop(room_name, None)
+            if not names:
+                index.pop(key, None)
+        for client in self._members.pop(room_name, {}).values():
+            self.participants.get(client.client_id, {}).pop(room_name, None)
+        self._dirty.discard(room_name)
+        self._set_participants(room, 0)
+        return room
+
+    def _set_participants(self, room: RoomModel, number: int):
+        """Update the participant number of a room and the totals."""
+        before = room.participants or 0
+        self.participant_total += number - before
+        self.active_rooms += (number > 0) - (before > 0)
+        room.participants = number
+
+    def _sync(self):
+        """
+        Rebuild the participants_list of the rooms changed since the last
+        call; use get_participants for an up to date list of one room.
+        """
+        for name in self._dirty:
+            room = self.rooms.get(name)
+            if room is not None:
+                room.participants_list = list(
+                    self._members.get(name, {}).values()
+                )
+        self._dirty.clear()
+
+    def _name(self, room: RoomModel) -> str:
+        """The key of a room in self.rooms."""
+        return self._names.get(id(room), room.room_name)
+
+    def _lookup(self, index: Dict, key) -> Optional[RoomModel]:
+        names = index.get(key)
+        if not names:
+            return
+        return self.rooms[next(iter(names))]
+
     def get_room(self, room_name: str = None, room_id: int = None):
         if room_id:
             rtc_room = self.get_room_by_id(room_id)
@@ -282,19 +377,17 @@ class RoomManage:
         return rtc_room
 
     def get_room_by_id(self, room_id: int):
-        for room in self.rooms.values():
-            if room.room_id == room_id:
-                return room
-        return
+        return self._lookup(self._by_id, room_id)
 
     def get_room_by_name(self, room_name):
         return self.rooms.get(room_name) or self.get_room_by_alias(room_name)
 
     def get_room_by_alias(self, room_alias):
-        for room in self.rooms.values():
-            if room.room_alias == room_alias:
-                return room
-        return
+        return self._lookup(self._by_alias, room_alias)
+
+    def get_participants(self, room: RoomModel) -> List[RoomClient]:
+        """The clients in a room, in the order they joined."""
+        return list(self._members.get(self._name(room), {}).values())
 
     def create_room(
             self,
@@ -308,52 +401,53 @@ class RoomManage:
         self.base_num += 1
         if not room_id:
             room_id = self.base_num
-        self.rooms[room_name] = RoomModel(
-            id=room_id,
+        self._add_room(room_name, RoomModel(
+            room_id=room_id,
             room_name=room_name,
             room_type=room_type,
+            service_id=self.service_id,
             max_users=max_users,
             participants=0,
             participants_list=[],
-        )
+        ))
         return self.rooms[room_name]
 
     def delete_room(self, room_name: str = None, room_id: int = None):
-        r = None
-        for key, room in self.rooms.items():
-            if room.room_name == room_name or str(room.room_id) == str(room_id):
-                r = key
-                break
-
-        if r:
-            del self.rooms[r]
-        return r
+        if room_name not in self.rooms:
+            names = self._by_id.get(room_id)
+            if not names and str(room_id).isdigit():
+                names = self._by_id.get(int(room_id))
+            room_name = next(iter(names)) if names else None
+        if self._remove_room(room_name) is None:
+            return
+        return room_name
 
     def join_room(self, room: RoomModel, client: RoomClient):
         if room.participants >= room.max_users:
             raise AttributeError(f"Room {room.room_name} is full")
-        participants_list = [
-            c for c in room.participants_list
-            if c.client_name != client.client_name
-        ]
-        participants_list.append(client)
+        name = self._name(room)
+        members = self._members.setdefault(name, {})
+        # a client rejoining under the same name replaces its old session
+        old = members.pop(client.client_name, None)
+        if old is not None and old.client_id != client.client_id:
+            self.participants.get(old.client_id, {}).pop(name, None)
+        members[client.client_name] = client
         if client.client_id not in self.participants:
             self.participants[client.client_id] = {}
-        self.participants[client.client_id][room.room_name] = client
-        room.participants_list = participants_list
-        room.participants = len(participants_list)
+        self.participants[client.client_id][name] = client
+        self._dirty.add(name)
+        self._set_participants(room, len(members))
 
     def leave_room(self, room: RoomModel, client_id: str):
+        name = self._name(room)
         rooms = self.participants.get(client_id, {})
-        if room.room_name not in rooms:
+        if name not in rooms:
             return
-        client = rooms[room.room_name]
-        room.participants_list = [
-            c for c in room.participants_list
-            if c.client_name != client.client_name
-        ]
-        room.participants = len(room.participants_list)
-        del self.participants[client_id][room.room_name]
+        client = rooms.pop(name)
+        members = self._members.get(name, {})
+        members.pop(client.client_name, None)
+        self._dirty.add(name)
+        self._set_participants(room, len(members))
 
     def kcick(self, client_id: str):
         if client_id not in self.participants:
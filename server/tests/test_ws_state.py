@@ -0,0 +1,145 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Signaling state shared by gateway workers through one Redis."""
+
+import asyncio
+import logging
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from server.apis.ws import WebRTCGatewayWSServer  # noqa: E402
+from server.orm.db import DataManage  # noqa: E402
+from server.orm.models import ICEServerModel  # noqa: E402
+from server.orm.models import RoomClient  # noqa: E402
+from server.orm.models import RoomManage  # noqa: E402
+from server.orm.models import ServiceModel  # noqa: E402
+
+SERVICE_ID = "svc"
+
+
+async def _managers(num: int):
+    """`num` DataManage, as on separate workers, sharing one Redis."""
+    server = fakeredis.FakeServer()
+    managers = []
+    for _ in range(num):
+        db = DataManage()
+        await db.create_redis("", client=fakeredis.FakeAsyncRedis(
+            server=server, decode_responses=True
+        ))
+        managers.append(db)
+    rooms = RoomManage(SERVICE_ID)
+    rooms.initial()
+    await managers[0].update_service(SERVICE_ID, ServiceModel(
+        service_id=SERVICE_ID,
+        ice_server=ICEServerModel(urls="stun:localhost"),
+        rooms=rooms.json(),
+        status="active",
+        create_time="2021-01-01 00:00:00",
+        update_time="2021-01-01 00:00:00",
+    ))
+    return managers
+
+
+async def _close(managers):
+    for db in managers:
+        await db.close_redis()
+
+
+def _join(sid: str, room_name: str = "map"):
+    def join(rtc: RoomManage):
+        rtc.join_room(rtc.get_room(room_name=room_name), RoomClient(
+            client_id=sid, client_name=sid, client_type="subscriber"
+        ))
+    return join
+
+
+def _members(rooms: RoomManage, room_name: str = "map"):
+    return sorted(
+        c.client_id for c in rooms.get_participants(rooms.rooms[room_name])
+    )
+
+
+def test_join_and_leave_across_workers():
+    async def main():
+        first, second = managers = await _managers(2)
+        try:
+            await first.modify_ws_rooms(SERVICE_ID, _join("a"))
+            await second.modify_ws_rooms(SERVICE_ID, _join("b"))
+            for db in managers:
+                assert _members(await db.get_ws_rooms(SERVICE_ID)) == [
+                    "a", "b"
+                ]
+            await second.modify_ws_rooms(
+                SERVICE_ID, lambda rtc: rtc.kcick("a")
+            )
+            rooms = await first.get_ws_rooms(SERVICE_ID)
+            assert _members(rooms) == ["b"]
+            assert rooms.get_room_of_client("a") == {}
+        finally:
+            await _close(managers)
+
+    asyncio.run(main())
+
+
+def test_concurrent_joins_are_not_lost():
+    async def main():
+        managers = await _managers(2)
+        sids = [f"c{i}" for i in range(6)]
+        try:
+            await asyncio.gather(*[
+                managers[inx % 2].modify_ws_rooms(SERVICE_ID, _join(sid))
+                for inx, sid in enumerate(sids)
+            ])
+            rooms = await managers[0].get_ws_rooms(SERVICE_ID)
+            assert _members(rooms) == sids
+        finally:
+            await _close(managers)
+
+    asyncio.run(main())
+
+
+def test_dead_replica_sessions_are_reaped():
+    async def main():
+        live, dead = managers = await _managers(2)
+        gateway = WebRTCGatewayWSServer(
+            logger=logging.getLogger(__name__), redis_client=live
+        )
+        try:
+            await live.register_replica(gateway.replica_id)
+            await dead.register_replica("dead")
+            for sid, db, replica_id in (
+                    ("a", live, gateway.replica_id), ("b", dead, "dead")
+            ):
+                await db.add_session(sid, SERVICE_ID, replica_id)
+                await db.modify_ws_rooms(SERVICE_ID, _join(sid))
+            # the dead worker stops announcing itself
+            await live.redis.delete(
+                DataManage.REDIS_PREFIX_WS_REPLICA + "dead:alive"
+            )
+            await gateway._reap_replicas()
+
+            assert await live.get_online(SERVICE_ID) == {"a"}
+            assert await live.get_session("b") is None
+            assert await live.get_session("a") == SERVICE_ID
+            assert _members(await live.get_ws_rooms(SERVICE_ID)) == ["a"]
+            assert await live.redis.smembers(
+                DataManage.REDIS_WS_REPLICAS
+            ) == {gateway.replica_id}
+        finally:
+            await _close(managers)
+
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Dict
+from typing import Optional
+
+import aiohttp
+from robosdk.common.logger import logging
+from robosdk.common.fileops import FileOps
+
+from server.utils.metrics import CONFIG_ARTIFACT_LOADS
+from server.utils.metrics import CONFIG_ARTIFACT_LOOKUPS
+
+
+class _Artifact:
+    __slots__ = ("data", "mtime", "etag", "checked", "loaded", "refresh")
+
+    def __init__(self):
+        self.data: Dict = {}
+        self.mtime: Optional[int] = None
+        # the ETag of an url, or the digest of a downloaded file
+        self.etag = ""
+        self.checked = 0.
+        self.loaded = False
+        self.refresh: Optional[asyncio.Task] = None
+
+
+class ArtifactCache:
+    """
+    Parsed JSON config artifacts, e.g. the skill and property maps.
+    A lookup returns the parsed map at once; every `check_s` it is
+    checked in the background and parsed again only when it changed:
+    by mtime for local files, by ETag for http(s) urls and by content
+    digest for the other urls FileOps downloads.
+    """
+    CHECK_S = 30
+
+    def __init__(
+            self,
+            session: Optional[aiohttp.ClientSession] = None,
+            check_s: float = CHECK_S
+    ):
+        self._session = session
+        self.check_s = check_s
+        self._artifacts: Dict[str, _Artifact] = {}
+        self.hits = 0
+        self.misses = 0
+        self.logger = logging.bind(instance="ArtifactCache", system=True)
+
+    async def get(self, path: str) -> Dict:
+        """The parsed JSON at `path`, {} when it cannot be loaded."""
+        artifact = self._artifacts.get(path)
+        if artifact is None:
+            artifact = self._artifacts[path] = _Artifact()
+            artifact.refresh = asyncio.ensure_future(
+                self._load(path, artifact)
+            )
+        if not artifact.loaded:
+            self.misses += 1
+            CONFIG_ARTIFACT_LOOKUPS.labels("miss").inc()
+            await asyncio.shield(artifact.refresh)
+            return artifact.data
+        self.hits += 1
+        CONFIG_ARTIFACT_LOOKUPS.labels("hit").inc()
+        if (
+                artifact.refresh is None and
+                time.monotonic() - artifact.checked >= self.check_s
+        ):
+            artifact.refresh = asyncio.ensure_future(
+                self._load(path, artifact)
+            )
+        return artifact.data
+
+    async def _load(self, path: str, artifact: _Artifact):
+        try:
+            if path.startswith(("http://", "https://")) and self._session:
+                await self._load_url(path, artifact)
+            elif os.path.isfile(path):
+                self._load_file(path, artifact)
+            else:
+                await self._load_download(path, artifact)
+        except Exception as err:  # noqa
+            # keep what was loaded before
+            self.logger.error(f"Load {path} failed: {err}")
+        finally:
+            artifact.loaded = True
+            artifact.checked = time.monotonic()
+            artifact.refresh = None
+
+    def _load_file(self, path: str, artifact: _Artifact):
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == artifact.mtime:
+            return
+        with open(path) as fin:
+            artifact.data = json.load(fin)
+        artifact.mtime = mtime
+        CONFIG_ARTIFACT_LOADS.inc()
+
+    async def _load_url(self, path: str, artifact: _Artifact):
+        headers = {"If-None-Match": artifact.etag} if artifact.etag else {}
+        async with self._session.get(path, headers=headers) as resp:
+            if resp.status == 304:
+                return
+            if resp.status != 200:
+                raise ValueError(f"status code {resp.status}")
+            data = json.loads(await resp.read())
+            etag = resp.headers.get("ETag", "")
+        artifact.data, artifact.etag = data, etag
+        CONFIG_ARTIFACT_LOADS.inc()
+
+    async def _load_download(self, path: str, artifact: _Artifact):
+        loop = asyncio.get_running_loop()
+        local = await loop.run_in_executor(None, FileOps.download, path)
+        if not (local and os.path.isfile(local)):
+            raise FileNotFoundError(path)
+        with open(local, "rb") as fin:
+            content = fin.read()
+        digest = hashlib.md5(content).hexdigest()
+        if digest == artifact.etag:
+            return
+        artifact.data, artifact.etag = json.loads(content), digest
+        CONFIG_ARTIFACT_LOADS.inc()
@@ -12,12 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os
-import json
+import time
 import asyncio
+import functools
+import itertools
 import traceback
+from collections import deque
+from typing import Any
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+from typing import Deque
 from typing import List
 from typing import Dict
+from typing import Optional
+from typing import Set
+from typing import Tuple
 from datetime import datetime
 from datetime import timedelta
 
@@ -25,10 +35,11 @@ import aiohttp
 from robosdk.common.config import Config
 from robosdk.common.exceptions import CloudError
 from robosdk.common.logger import logging
-from robosdk.common.fileops import FileOps
 from server.orm.models import Architecture
 
 from server.utils.utils import genearteMD5
+from server.utils.artifacts import ArtifactCache
+from server.utils.metrics import OMS_POLL_DURATION
 
 _CloudAPI = {
     "HuaweiCloud": {
@@ -43,8 +54,11 @@ _CloudAPI = {
 class CloudAPIProxy:
     _ENDPOINT_NAME = "IAM_ENDPOINT"
     _DOMAIN_NAME = "IAM_DOMAIN"
+    _page_size = 100
+    _ext_header: Dict[str, str] = {}
     __timeout__ = 10
     __update_token_period__ = 60
+    __page_concurrency__ = 8
 
     def __init__(self, config: Config, resource: str = ""):
         self.__session__ = aiohttp.ClientSession(
@@ -69,6 +83,75 @@ class CloudAPIProxy:
     def update_token(self, token: str = "", project_id: str = "", rtc_token: str = "", rtc_project_id: str = ""):
         raise NotImplementedError
 
+    @property
+    def page_concurrency(self) -> int:
+        """ pages of a list fetched at the same time """
+        try:
+            return max(1, int(self.config.get(
+                "cloud_page_concurrency", self.__page_concurrency__
+            )))
+        except (TypeError, ValueError):
+            return self.__page_concurrency__
+
+    async def _get_page(
+            self, url: str, key: str, params: Dict[str, Any],
+            offset: int, error: str = "get list failed"
+    ) -> Tuple[List, int]:
+        """ get a page of a list and the total count """
+        data = dict(params)
+        data.update(limit=int(self._page_size), offset=int(offset))
+        resp = await self.__session__.get(
+            url,
+            params=data,
+            headers=self._ext_header
+        )
+        if resp.status != 200:
+            _text = await resp.text()
+            self.logger.debug(f"Call {url} fail: {data} => {_text}")
+            raise CloudError(error, resp.status)
+        res = await resp.json()
+        count = res.get("count", res.get("page", {}).get("count", 0))
+        return res.get(key, []), count
+
+    def _list_pages(
+            self, url: str, key: str, params: Dict[str, Any] = None,
+            error: str = "get list failed"
+    ) -> AsyncIterator[List]:
+        """ stream the pages of the list at `url`, `key` holds items """
+        return self._iter_pages(functools.partial(
+            self._get_page, url, key, params or {}, error=error
+        ))
+
+    async def _iter_pages(
+            self,
+            get_page: Callable[[int], Awaitable[Tuple[List, int]]]
+    ) -> AsyncIterator[List]:
+        """
+        Stream the pages of a paged list in order. `get_page(offset)`
+        returns the items of a page and the total count, which the
+        first page tells; up to `page_concurrency` of the next pages
+        are fetched while the caller handles the current one.
+        """
+        items, count = await get_page(0)
+        offsets = iter(range(self._page_size, count, self._page_size))
+        pending: Deque[asyncio.Future] = deque(
+            asyncio.ensure_future(get_page(offset))
+            for offset in itertools.islice(offsets, self.page_concurrency)
+        )
+        try:
+            yield items
+            while pending:
+                page, _ = await pending.popleft()
+                for offset in itertools.islice(offsets, 1):
+                    pending.append(asyncio.ensure_future(get_page(offset)))
+                yield page
+        finally:
+            # the caller stopped early or a page failed
+            for task in pending:
+                if task.done() and not task.cancelled():
+                    task.exception()
+                task.cancel()
+
     async def close(self):
         await self.__session__.close()
         self._should_exit = True
@@ -286,8 +369,77 @@ class CloudAuthProxy(CloudAPIProxy):
         return
 
 
+class DeploymentStore:
+    """
+    OMS app deployments indexed by id and by name. Creates and deletes
+    update it in place; `reconcile` replaces it with a full listing,
+    keeping the changes made while the listing was fetched.
+    """
+
+    def __init__(self):
+        self._by_id: Dict[str, Dict] = {}
+        self._by_name: Dict[str, Set[str]] = {}
+        # id => deployment or None when deleted, while a listing runs
+        self._changes: Optional[Dict[str, Optional[Dict]]] = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    @property
+    def by_id(self) -> Dict[str, Dict]:
+        return dict(self._by_id)
+
+    def find(self, name: str) -> List[Dict]:
+        """ deployments named `name` """
+        return [self._by_id[_id] for _id in self._by_name.get(name, ())]
+
+    def add(self, deployment: Dict):
+        _id = deployment.get("id", "")
+        if not _id:
+            return
+        self._drop(_id)
+        self._by_id[_id] = deployment
+        self._by_name.setdefault(
+            deployment.get("name", ""), set()
+        ).add(_id)
+        if self._changes is not None:
+            self._changes[_id] = deployment
+
+    def remove(self, deployment_id: str):
+        self._drop(deployment_id)
+        if self._changes is not None:
+            self._changes[deployment_id] = None
+
+    def _drop(self, deployment_id: str):
+        deployment = self._by_id.pop(deployment_id, None)
+        if deployment is None:
+            return
+        ids = self._by_name.get(deployment.get("name", ""), set())
+        ids.discard(deployment_id)
+        if not ids:
+            self._by_name.pop(deployment.get("name", ""), None)
+
+    async def reconcile(self, get_all: Callable[[], Awaitable[List]]):
+        """ replace the store with the deployments `get_all` lists """
+        self._changes = {}
+        try:
+            deployments = await get_all()
+        except BaseException:
+            self._changes = None
+            raise
+        changes, self._changes = self._changes, None
+        self._by_id.clear()
+        self._by_name.clear()
+        for deployment in deployments:
+            self.add(deployment)
+        for _id, deployment in changes.items():
+            if deployment is None:
+                self._drop(_id)
+            else:
+                self.add(deployment)
+
+
 class CloudOMSProxy(CloudAPIProxy):
-    _page_size = 100
     __update_period__ = 60
 
     def __init__(
@@ -314,7 +466,7 @@ class CloudOMSProxy(CloudAPIProxy):
         except ValueError:
             self.default_app_arch = Architecture.amd64
         self._robot_data: List = []
-        self._deployment_data: List = []
+        self._deployments = DeploymentStore()
 
         self._robot_data_lock = asyncio.Lock()
         self._app_data_lock = asyncio.Lock()
@@ -322,6 +474,8 @@ class CloudOMSProxy(CloudAPIProxy):
         self._all_skills_map = {}
         self._all_properties_map = {}
         super(CloudOMSProxy, self).__init__(config, resource)
+        # skill and property maps, parsed again only when they change
+        self._artifacts = ArtifactCache(self.__session__)
 
     def update_token(self, token: str = "", project_id: str = "", rtc_token: str = "", rtc_project_id: str = ""):
         if token:
@@ -349,14 +503,22 @@ class CloudOMSProxy(CloudAPIProxy):
             if self._should_exit:
                 break
             if self._token and self._project_id:
+                start = time.perf_counter()
+                status = "ok"
                 try:
                     async with self._deployment_data_lock:
-                        self._deployment_data = await self.get_app_deployment()
+                        await self._deployments.reconcile(
+                            self.get_app_deployment
+                        )
                     async with self._robot_data_lock:
                         self._robot_data = await self.get_robots()
                 except Exception as e:
+                    status = "error"
                     self.logger.debug(traceback.format_exc())
                     self.logger.error(f"Update oms data failed: {e}")
+                OMS_POLL_DURATION.labels(status).observe(
+                    time.perf_counter() - start
+                )
                 await asyncio.sleep(self.__update_period__)
             await asyncio.sleep(1)
 
@@ -369,8 +531,8 @@ class CloudOMSProxy(CloudAPIProxy):
         return len(self._robot_data)
 
     @property
-    def deployments(self):
-        return {d["id"]: d for d in self._deployment_data if "id" in d}
+    def deployments(self) -> Dict[str, Dict]:
+        return self._deployments.by_id
 
     async def get_robot_skills(
             self,
@@ -400,24 +562,9 @@ class CloudOMSProxy(CloudAPIProxy):
             return self._all_properties_map[robot_type]
         return {}
 
-    async def get_robots(self, offset: int = 0) -> List:
-        """ get all robot """
+    async def iter_robots(self) -> AsyncIterator[Dict]:
+        """ stream all robot, with their skills and properties """
         url = f"{self.server_uri}/roboinstances"
-        data = {
-            "limit": int(self._page_size),
-            "offset": int(offset),
-            "sort_key": "created_at",
-            "sort_dir": "desc"
-        }
-        resp = await self.__session__.get(
-            url,
-            params=data,
-            headers=self._ext_header
-        )
-        if resp.status != 200:
-            _text = await resp.text()
-            self.logger.debug(f"Call {url} fail: {data} => {_text}")
-            raise CloudError("get oms instance failed", resp.status)
         """
         "roboinstances": [
               {
@@ -435,49 +582,37 @@ class CloudOMSProxy(CloudAPIProxy):
         ],
         "count": 15
         """
-        res = await resp.json()
-        all_robot = res.get("roboinstances", [])
-        count = res.get("count", 0)
-
         skill_json_file = self.config.get("skill_json_file", "").strip()
         if skill_json_file:
-            self._all_skills_map = self._parse_json(skill_json_file)
+            self._all_skills_map = await self._artifacts.get(skill_json_file)
         property_json_file = self.config.get("property_json_file", "").strip()
         if property_json_file:
-            self._all_properties_map = self._parse_json(property_json_file)
-
-        for robot in all_robot:
-            robot["skills"] = await self.get_robot_skills(
-                robot_id=robot.get("id", ""),
-                robot_type=robot.get("type", "")
-            )
-            properties = await self.get_robot_properties(
-                robot_id=robot.get("id", ""),
-                robot_type=robot.get("type", "")
+            self._all_properties_map = await self._artifacts.get(
+                property_json_file
             )
-            if "properties" not in robot:
-                robot["properties"] = {}
-            robot["properties"].update(properties)
-        if count > offset + self._page_size:
-            all_robot.extend(
-                await self.get_robots(offset + self._page_size)
-            )
-        return all_robot
 
-    @staticmethod
-    def _parse_json(json_str: str) -> Dict:
-        _map = {}
-        try:
-            _json_file = FileOps.download(json_str)
-        except:  # noqa
-            _json_file = ""
-        if os.path.isfile(_json_file):
-            try:
-                with open(_json_file) as fin:
-                    _map = json.load(fin)
-            except:  # noqa
-                pass
-        return _map
+        async for page in self._list_pages(
+                url, "roboinstances",
+                {"sort_key": "created_at", "sort_dir": "desc"},
+                error="get oms instance failed"
+        ):
+            for robot in page:
+                robot["skills"] = await self.get_robot_skills(
+                    robot_id=robot.get("id", ""),
+                    robot_type=robot.get("type", "")
+                )
+                properties = await self.get_robot_properties(
+                    robot_id=robot.get("id", ""),
+                    robot_type=robot.get("type", "")
+                )
+                if "properties" not in robot:
+                    robot["properties"] = {}
+                robot["properties"].update(properties)
+                yield robot
+
+    async def get_robots(self) -> List:
+        """ get all robot """
+        return [robot async for robot in self.iter_robots()]
 
     async def get_robot(self, robot_id: str) -> Dict:
         """ get robot by id """
@@ -507,25 +642,9 @@ class CloudOMSProxy(CloudAPIProxy):
 
         return await resp.json()
 
-    async def get_apps(self, name: str = "", offset: int = 0) -> List:
-        """ get all app """
+    async def iter_apps(self, name: str = "") -> AsyncIterator[Dict]:
+        """ stream all app """
         url = f"{self.server_uri}/roboapps"
-        data = {
-            "name": name,
-            "limit": int(self._page_size),
-            "offset": int(offset),
-            "sort_key": "created_at",
-            "sort_dir": "desc"
-        }
-        resp = await self.__session__.get(
-            url,
-            params=data,
-            headers=self._ext_header
-        )
-        if resp.status != 200:
-            _text = await resp.text()
-            self.logger.debug(f"Call {url} fail: {data} => {_text}")
-            raise CloudError("get oms instance failed", resp.status)
         """{
             "roboapps": [
                 {
@@ -543,17 +662,17 @@ class CloudOMSProxy(CloudAPIProxy):
                 "count": 1
             }
         }"""
-        res = await resp.json()
-        all_app = res.get("roboapps", [])
-        count = res.get("page", {}).get("count", 0)
-        if count > offset + self._page_size:
-            all_app.extend(
-                await self.get_apps(
-                    name=name,
-                    offset=offset + self._page_size
-                )
-            )
-        return all_app
+        async for page in self._list_pages(
+                url, "roboapps",
+                {"name": name, "sort_key": "created_at", "sort_dir": "desc"},
+                error="get oms instance failed"
+        ):
+            for app in page:
+                yield app
+
+    async def get_apps(self, name: str = "") -> List:
+        """ get all app """
+        return [app async for app in self.iter_apps(name)]
 
     async def get_app(self, app_id: str) -> Dict:
         """ get app by id """
@@ -588,11 +707,23 @@ class CloudOMSProxy(CloudAPIProxy):
         """ create app """
         url = f"{self.server_uri}/roboapps"
 
-        for app in await self.get_apps(name):
-            if app.get("name") == name:
+        app_id = ""
+        stale = []
+        apps = self.iter_apps(name)
+        try:
+            async for app in apps:
+                if app.get("name") != name:
+                    continue
                 if app.get("package_url") == package_url:
-                    return app.get("id")
-                await self.delete_app(app.get("id"))
+                    app_id = app.get("id")
+                    break
+                stale.append(app.get("id"))
+        finally:
+            await apps.aclose()
+        for _id in stale:
+            await self.delete_app(_id)
+        if app_id:
+            return app_id
 
         data = {
             "name": name,
@@ -691,18 +822,9 @@ class CloudOMSProxy(CloudAPIProxy):
             self.logger.error(
                 "delete app version failed", traceback.format_exc())
 
-    async def get_app_deployment(self, offset: int = 0) -> List:
-        """ get app deployment """
+    async def iter_app_deployments(self) -> AsyncIterator[Dict]:
+        """ stream all app deployment """
         url = f"{self.server_uri}/deployments"
-
-        resp = await self.__session__.get(
-            url,
-            headers=self._ext_header
-        )
-        if resp.status != 200:
-            _text = await resp.text()
-            self.logger.debug(f"Call {url} fail: => {_text}")
-            raise CloudError("get app deployment failed", resp.status)
         """{
             "deployment_infos": [
                 {
@@ -714,17 +836,15 @@ class CloudOMSProxy(CloudAPIProxy):
             ],
             "count": 2
         }"""
-        res = await resp.json()
-        # self.logger.debug(f"get app deployment: {res}")
-        all_deployment = res.get("deployment_infos", [])
-        count = res.get("count", 0)
-        if count > offset + self._page_size:
-            all_deployment.extend(
-                await self.get_app_deployment(
-                    offset=offset + self._page_size
-                )
-            )
-        return all_deployment
+        async for page in self._list_pages(
+                url, "deployment_infos", error="get app deployment failed"
+        ):
+            for deployment in page:
+                yield deployment
+
+    async def get_app_deployment(self) -> List:
+        """ get app deployment """
+        return [d async for d in self.iter_app_deployments()]
 
     async def create_app_deployment(
             self,
@@ -740,13 +860,12 @@ class CloudOMSProxy(CloudAPIProxy):
     ):
         deploy_name = genearteMD5(f"{app_id}_{version}_{robot_id}")
 
-        for deployment in self._deployment_data:
-            if deployment.get("name", "") == deploy_name:
-                status = deployment.get("status", "")
-                self.logger.debug(
-                    f"deployment {deploy_name} already exists, {status}"
-                )
-                await self.delete_app_deployment(deployment.get("id", ""))
+        for deployment in self._deployments.find(deploy_name):
+            status = deployment.get("status", "")
+            self.logger.debug(
+                f"deployment {deploy_name} already exists, {status}"
+            )
+            await self.delete_app_deployment(deployment.get("id", ""))
         launch_config = {
             "host_network": True,
             "privileged": False,
@@ -793,17 +912,24 @@ class CloudOMSProxy(CloudAPIProxy):
             self.logger.debug(f"Call {url} fail: {data} => {_text}")
             raise CloudError("create app deployment failed", resp.status)
         res = await resp.json()
+        self._deployments.add(
+            {"name": deploy_name, "robot_id": robot_id, **res}
+        )
         return res.get("id", "")
 
     async def delete_app_deployment(self, deployment_id: str):
         """ delete app deployment """
         url = f"{self.server_uri}/deployments/{deployment_id}"
         try:
-            await self.__session__.delete(
+            resp = await self.__session__.delete(
                 url,
                 headers=self._ext_header
             )
-            self._deployment_data = await self.get_app_deployment()
+            if resp.status < 300 or resp.status == 404:
+                self._deployments.remove(deployment_id)
+            else:
+                _text = await resp.text()
+                self.logger.debug(f"Call {url} fail: => {_text}")
         except:  # noqa
             self.logger.error(
                 "delete app deployment failed", traceback.format_exc()
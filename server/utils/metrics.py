@@ -0,0 +1,224 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import time
+import inspect
+import functools
+from typing import Callable
+from typing import Dict
+from typing import Tuple
+
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import generate_latest
+from prometheus_client import CONTENT_TYPE_LATEST
+
+REGISTRY = CollectorRegistry(auto_describe=True)
+
+_LATENCY_BUCKETS = (
+    .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5.
+)
+
+SOCKET_EVENTS = Counter(
+    "teleop_socket_events_total",
+    "Socket.IO events handled by the gateway",
+    ["event", "status"],
+    registry=REGISTRY,
+)
+SOCKET_EVENT_LATENCY = Histogram(
+    "teleop_socket_event_duration_seconds",
+    "Socket.IO event handler latency",
+    ["event"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+ACTIVE_SERVICES = Gauge(
+    "teleop_active_services",
+    "Services with room state loaded on this gateway",
+    registry=REGISTRY,
+)
+CONNECTED_CLIENTS = Gauge(
+    "teleop_connected_clients",
+    "Socket.IO clients connected to this gateway",
+    registry=REGISTRY,
+)
+ACTIVE_ROOMS = Gauge(
+    "teleop_active_rooms",
+    "RTC rooms with at least one participant",
+    registry=REGISTRY,
+)
+ACTIVE_PARTICIPANTS = Gauge(
+    "teleop_active_participants",
+    "Participants joined to RTC rooms",
+    registry=REGISTRY,
+)
+REDIS_LATENCY = Histogram(
+    "teleop_redis_call_duration_seconds",
+    "Latency of DataManage calls to Redis",
+    ["method"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+LINK_BITRATE = Gauge(
+    "teleop_link_bitrate_bps",
+    "Outbound bitrate reported by a robot worker",
+    ["service_id", "worker"],
+    registry=REGISTRY,
+)
+LINK_RTT = Gauge(
+    "teleop_link_rtt_seconds",
+    "Mean round trip time reported by a robot worker",
+    ["service_id", "worker"],
+    registry=REGISTRY,
+)
+LINK_FRACTION_LOST = Gauge(
+    "teleop_link_fraction_lost",
+    "Worst fraction of packets lost reported by a robot worker",
+    ["service_id", "worker"],
+    registry=REGISTRY,
+)
+LINK_COUNTERS = Gauge(
+    "teleop_link_counter",
+    "Cumulative link counters reported by a robot worker",
+    ["service_id", "worker", "name"],
+    registry=REGISTRY,
+)
+LINK_PEERS = Gauge(
+    "teleop_link_peers",
+    "Connected peers reported by a robot worker",
+    ["service_id", "worker"],
+    registry=REGISTRY,
+)
+_LINK_COUNTER_NAMES = (
+    "packetsLost", "nackCount", "pliCount", "framesEncoded"
+)
+_LINK_FIELDS = (
+    "peers", "bitrate", "rtt", "fractionLost"
+) + _LINK_COUNTER_NAMES
+OMS_POLL_DURATION = Histogram(
+    "teleop_oms_poll_duration_seconds",
+    "Duration of one CloudOMSProxy refresh of robots and deployments",
+    ["status"],
+    buckets=(.1, .25, .5, 1., 2.5, 5., 10., 30., 60., 120.),
+    registry=REGISTRY,
+)
+
+CONFIG_ARTIFACT_LOOKUPS = Counter(
+    "teleop_config_artifact_lookups_total",
+    "Lookups of parsed config artifacts such as the skill json",
+    ["result"],
+    registry=REGISTRY,
+)
+CONFIG_ARTIFACT_LOADS = Counter(
+    "teleop_config_artifact_loads_total",
+    "Config artifacts parsed because they were new or changed",
+    registry=REGISTRY,
+)
+
+
+def track_event(event: str, handler: Callable) -> Callable:
+    """
+    Wrap a socket.io handler to count calls and observe its latency.
+    Extra arguments are dropped so that socket.io keeps calling the
+    handler with the arguments it accepts.
+    """
+    arity = len(inspect.signature(handler).parameters)
+
+    @functools.wraps(handler)
+    async def wrapper(*args):
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return await handler(*args[:arity])
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            SOCKET_EVENTS.labels(event, status).inc()
+            SOCKET_EVENT_LATENCY.labels(event).observe(
+                time.perf_counter() - start
+            )
+
+    return wrapper
+
+
+def timed_redis(method: str) -> Callable:
+    """Observe the latency of an async DataManage method."""
+
+    def decorator(func: Callable) -> Callable:
+        histogram = REDIS_LATENCY.labels(method)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def clean_link_stats(stats: Dict) -> Dict[str, float]:
+    """The known numeric fields of a reported aggregate, others left out."""
+    clean = {}
+    for name in _LINK_FIELDS:
+        value = stats.get(name)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if math.isfinite(value):
+            clean[name] = float(value)
+    return clean
+
+
+def set_link_stats(service_id: str, worker: str, stats: Dict):
+    """
+    Export the link quality aggregate of one robot worker, as cleaned
+    by clean_link_stats.
+    """
+    LINK_PEERS.labels(service_id, worker).set(stats.get("peers") or 0)
+    LINK_BITRATE.labels(service_id, worker).set(stats.get("bitrate") or 0)
+    LINK_FRACTION_LOST.labels(service_id, worker).set(
+        stats.get("fractionLost") or 0
+    )
+    if stats.get("rtt") is not None:
+        LINK_RTT.labels(service_id, worker).set(stats["rtt"])
+    for name in _LINK_COUNTER_NAMES:
+        LINK_COUNTERS.labels(service_id, worker, name).set(
+            stats.get(name) or 0
+        )
+
+
+def remove_link_stats(service_id: str, worker: str):
+    """Drop the link quality series of one robot worker."""
+    for gauge in (LINK_PEERS, LINK_BITRATE, LINK_FRACTION_LOST, LINK_RTT):
+        try:
+            gauge.remove(service_id, worker)
+        except KeyError:
+            pass
+    for name in _LINK_COUNTER_NAMES:
+        try:
+            LINK_COUNTERS.remove(service_id, worker, name)
+        except KeyError:
+            pass
+
+
+def render() -> Tuple[bytes, str]:
+    """Return the Prometheus text exposition of all gateway metrics."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,78 @@
+# Copyright 2021 The KubeEdge Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import hashlib
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to nodes. Adding or removing a
+    node only moves the keys of the ring segments it gains or loses.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 64):
+        """
+        :param nodes: The initial nodes.
+        :param vnodes: Points of each node on the ring, more points
+            spread the keys more evenly.
+        """
+        self.vnodes = vnodes
+        self._nodes: Set[str] = set()
+        self._points: List[Tuple[int, str]] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(
+            hashlib.md5(key.encode("utf-8")).digest()[:8], "big"
+        )
+
+    @property
+    def nodes(self) -> Set[str]:
+        return set(self._nodes)
+
+    def add(self, node: str):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.vnodes):
+            bisect.insort(self._points, (self._hash(f"{node}#{i}"), node))
+
+    def remove(self, node: str):
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._points = [p for p in self._points if p[1] != node]
+
+    def update(self, nodes: Iterable[str]):
+        """Make the ring hold exactly `nodes`."""
+        nodes = set(nodes)
+        for node in self._nodes - nodes:
+            self.remove(node)
+        for node in nodes - self._nodes:
+            self.add(node)
+
+    def get(self, key: str) -> Optional[str]:
+        """The node owning `key`, None if the ring is empty."""
+        if not self._points:
+            return
+        inx = bisect.bisect(self._points, (self._hash(key), ""))
+        return self._points[inx % len(self._points)][1]
@@ -12,11 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
+import binascii
 from datetime import datetime
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Type
 
 import hashlib
 import hmac
+from pydantic import BaseModel
 from robosdk.utils.util import singleton
+from robosdk.common.exceptions import CloudError
 from robosdk.common.logger import logging
 from robosdk.common.class_factory import ClassFactory
 from robosdk.common.class_factory import ClassType
@@ -48,6 +56,80 @@ def gen_token(length: int = 4):
     )[:length]
 
 
+def parse_fields(
+        fields: Optional[str], model: Type[BaseModel]
+) -> Optional[List[str]]:
+    """
+    Parse a comma separated `fields` query parameter into field names
+    of `model`; None when no fields are asked for, meaning all of them.
+    """
+    if not fields:
+        return
+    names = list(dict.fromkeys(
+        name.strip() for name in fields.split(",") if name.strip()
+    ))
+    unknown = [name for name in names if name not in model.__fields__]
+    if unknown:
+        raise CloudError(f"unknown fields {', '.join(unknown)}", 400)
+    return names or None
+
+
+def encode_cursor(last_id: Optional[str]) -> Optional[str]:
+    """Make an opaque page cursor of the last id of a page."""
+    if last_id is None:
+        return
+    return base64.urlsafe_b64encode(last_id.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> str:
+    """Get the id to continue after from a page cursor."""
+    if not cursor:
+        return ""
+    try:
+        return base64.b64decode(
+            cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True
+        ).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise CloudError("invalid cursor", 400)
+
+
+def parse_limit(limit: Optional[int], default: int = 100,
+                maximum: int = 500) -> int:
+    """Check the page size asked for."""
+    if limit is None:
+        return default
+    if not 0 < limit <= maximum:
+        raise CloudError(f"limit must be between 1 and {maximum}", 400)
+    return limit
+
+
+def make_etag(version: Optional[str]) -> Optional[str]:
+    """The ETag header value of a version tag."""
+    if not version:
+        return
+    return f'"{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Whether an If-None-Match header holds `etag`."""
+    if not (if_none_match and etag):
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag or tag == "*":
+            return True
+    return False
+
+
+def etag_headers(etag: Optional[str]) -> Dict[str, str]:
+    """Headers making clients revalidate a response with its ETag."""
+    if not etag:
+        return {}
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
 @singleton
 class EventManager:
     _event = {}